@@ -0,0 +1,43 @@
+"""add queued partial indexes
+
+Revision ID: 29ef31161195
+Revises: c020a5f3c2f5
+Create Date: 2026-10-16 09:12:41.204817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '29ef31161195'
+down_revision: Union[str, Sequence[str], None] = 'c020a5f3c2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY нельзя внутри транзакции — поэтому autocommit_block.
+    # claim в notifications_runner идёт FIFO (ORDER BY id LIMIT ...) — индекс
+    # по (id) только queued-строк, LIMIT дочитывает его по порядку.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_match_events_queued_id', 'match_events', ['id'], unique=False,
+            postgresql_where=sa.text("notify_status = 'queued'"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_digest_events_queued_id', 'digest_events', ['id'], unique=False,
+            postgresql_where=sa.text("notify_status = 'queued'"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_digest_events_queued_id', table_name='digest_events', postgresql_concurrently=True)
+        op.drop_index('ix_match_events_queued_id', table_name='match_events', postgresql_concurrently=True)
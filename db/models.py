@@ -102,6 +102,18 @@ class MatchEvent(Base):
 
     __table_args__ = (
         UniqueConstraint("subscription_id", "message_id", name="uq_match_subscription_message"),
+        # горячая выборка notifications_runner: только queued (partial index).
+        # INCLUDE-колонки сюда не добавляем: claim идёт через
+        # UPDATE ... FOR UPDATE SKIP LOCKED RETURNING, он всё равно читает и
+        # лочит heap-строку, так что index-only scan невозможен, а excerpt
+        # в индексе только раздул бы его.
+        # claim идёт FIFO: ORDER BY id LIMIT ... по partial index только
+        # queued-строк — LIMIT дочитывает индекс по порядку, без сортировки.
+        sa.Index(
+            "ix_match_events_queued_id",
+            "id",
+            postgresql_where=sa.text("notify_status = 'queued'"),
+        ),
     )
 
 class DigestEvent(Base):
@@ -126,6 +138,13 @@ class DigestEvent(Base):
     __table_args__ = (
         UniqueConstraint("subscription_id", "end_message_id", name="uq_digest_subscription_endmsg"),
         sa.Index("ix_digest_subscription_created", "subscription_id", "created_at"),
+        # claim в notifications_runner идёт FIFO: ORDER BY id LIMIT ... по
+        # partial index только queued-строк — индекс не растёт с историей.
+        sa.Index(
+            "ix_digest_events_queued_id",
+            "id",
+            postgresql_where=sa.text("notify_status = 'queued'"),
+        ),
     )
 
 class BotUserLink(Base):
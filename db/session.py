@@ -12,19 +12,48 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set")
 
-# Render часто даёт postgres://... или postgresql://. .., async SQLAlchemy ждёт postgresql+asyncpg://
+# Драйвер: asyncpg по умолчанию, psycopg3 — через DB_DRIVER=psycopg
+# (psycopg[binary] уже в requirements, им же ходит alembic).
+DB_DRIVER = (os.getenv("DB_DRIVER") or "asyncpg").strip().lower()
+if DB_DRIVER not in {"asyncpg", "psycopg"}:
+    raise RuntimeError(f"Unsupported DB_DRIVER: {DB_DRIVER}")
+
+# Render часто даёт postgres://... или postgresql://. .., async SQLAlchemy ждёт postgresql+<driver>://
 if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
+    DATABASE_URL = DATABASE_URL.replace("postgres://", f"postgresql+{DB_DRIVER}://", 1)
 elif DATABASE_URL.startswith("postgresql://"):
-    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+    DATABASE_URL = DATABASE_URL.replace("postgresql://", f"postgresql+{DB_DRIVER}://", 1)
+
+# Размер пула можно подкрутить через ENV без деплоя кода (API + раннеры
+# делят одну БД, на Render лимит соединений небольшой).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_OVERFLOW = int(os.getenv("DB_POOL_OVERFLOW", "20"))
+
+if DB_DRIVER == "psycopg":
+    _connect_args = {
+        # короткие OLTP-запросы: JIT Postgres тут только добавляет latency
+        "options": "-c jit=off",
+    }
+else:
+    _connect_args = {
+        # кэш prepared statements: SQLAlchemy-адаптер + сам asyncpg
+        "prepared_statement_cache_size": 256,
+        "statement_cache_size": 256,
+        # короткие OLTP-запросы: JIT Postgres тут только добавляет latency
+        "server_settings": {"jit": "off"},
+    }
 
 engine = create_async_engine(
     DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=10,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_OVERFLOW,
     pool_timeout=30,
     pool_recycle=1800,
+    # flush пачки ORM-объектов (UsageEvent батчем в notifications_runner и т.п.)
+    # уходит multi-row INSERT'ами по 1000 строк на страницу
+    insertmanyvalues_page_size=1000,
+    connect_args=_connect_args,
 )
 
 AsyncSessionLocal = async_sessionmaker(
@@ -1,21 +1,40 @@
 # jobs/notifications_runner.py
 import asyncio
+import logging
 import os
+import queue
+import sys
 import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import accumulate, groupby
+from logging.handlers import QueueHandler, QueueListener
+from operator import attrgetter
 from zoneinfo import ZoneInfo
 
 import sqlalchemy as sa
 from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import SQLAlchemyError
 
 from db.session import AsyncSessionLocal
-from db.models import Subscription, MatchEvent, DigestEvent, BotUserLink, User, UsageEvent
+from db.models import Subscription, MatchEvent, DigestEvent, User, UsageEvent
 # используем уже существующие функции из main.py
-from main import build_tg_message_link, bot_send_message
+from main import (
+    BotRetryAfter,
+    build_tg_chat_link_prefix,
+    bot_send_message,
+    close_bot_http_client,
+    get_bot_dest_chat_ids,
+)
 from bot_i18n import t as bot_t, months as bot_months, weekdays as bot_weekdays
 
 
+log = logging.getLogger("notifications_runner")
+
+
 # -----------------------------
 # Config / constants
 # -----------------------------
@@ -28,10 +47,32 @@ STATUS_SENDING = "sending"
 STATUS_SENT = "sent"
 STATUS_FAILED = "failed"
 
+# Потолок числа id в одном UPDATE статусов. id передаём одним массивом
+# (= ANY($1)), а не IN (...) с параметром на каждый id: текст запроса не
+# зависит от размера батча, и prepared statement переиспользуется.
+MARK_CHUNK_SIZE = 1000
+
+# Параллельные отправки в Bot API и их общий темп (глобальный лимит
+# Telegram ~30 msg/s на бота; держим небольшой запас)
+SEND_CONCURRENCY = 10
+SEND_RATE_PER_SEC = 25
+# В один чат Telegram пускает ~1 msg/s — несколько подписок одного владельца
+# шлём в его чат по очереди с таким интервалом
+PER_CHAT_MIN_INTERVAL_SEC = 1.0
+
+# 429 flood control: ждём retry_after и повторяем, но не дольше этого в
+# пределах тика; иначе событие возвращается в queued до следующего тика
+SEND_MAX_ATTEMPTS = 3
+SEND_MAX_RETRY_AFTER_SEC = 30
+
 # Для Telegram ограничение ~4096 символов, но в твоей задаче — digest и events уже форматируются отдельно.
 # Здесь можно оставить запас, но это не обязательно для digest.
 TG_MSG_HARD_LIMIT = 4096
 
+# Сообщения нескольких подписок одного владельца склеиваем в один
+# sendMessage (пока влезает в TG_MSG_HARD_LIMIT) через этот разделитель
+MATCH_BUNDLE_SEPARATOR = "\n\n——\n\n"
+
 
 # -----------------------------
 # UsageEvent helpers (bot dispatch)
@@ -54,6 +95,8 @@ def _derive_dispatch_error_code(error: BaseException) -> str:
     msg = str(error) if error is not None else ""
     if msg.startswith("NO_BOT_USER_LINK"):
         return "NO_BOT_USER_LINK"
+    if isinstance(error, BotRetryAfter):
+        return "BOT_RATE_LIMITED"
     return "BOT_SEND_FAILED"
 
 
@@ -69,8 +112,9 @@ async def _record_bot_dispatch_event(
 ) -> None:
     """
     Add a bot_dispatch_success / bot_dispatch_failed UsageEvent to the
-    current session and commit. Called right after _mark_match_events /
-    _mark_digest_events so it shares their transaction boundary.
+    current session. Не коммитит: событие уходит в БД вместе с батчем
+    статусов в конце фазы (_commit_outcomes), так что UsageEvent и
+    sent/failed всегда в одной транзакции.
 
     Meta keys with None values are stripped to keep storage compact.
     """
@@ -87,48 +131,34 @@ async def _record_bot_dispatch_event(
                 meta_json=clean_meta,
             )
         )
-        await db.commit()
     except Exception as log_err:  # noqa: BLE001
         # Don't let UsageEvent failure mask the actual dispatch outcome.
-        print(
-            f"[notifications_runner] failed to log bot_dispatch event "
-            f"(success={success}) sub_id={subscription_id} owner={owner_user_id} err={log_err}"
+        # Rollback здесь нельзя — он снёс бы весь накопленный батч.
+        log.warning(
+            "failed to log bot_dispatch event (success=%s) sub_id=%s owner=%s err=%s",
+            success, subscription_id, owner_user_id, log_err,
         )
-        try:
-            await db.rollback()
-        except Exception:
-            pass
-
-
-def _utc_now() -> datetime:
-    return datetime.now(timezone.utc)
 
 
 # -----------------------------
 # Shared helpers
 # -----------------------------
-async def _get_dest_chat_id(db, owner_user_id: int) -> int | None:
-    """
-    Берём последний активный BotUserLink для owner_user_id.
-    Предполагаем (как ты сказала), что owner_user_id в bot_user_link заполнен.
-    """
-    q = (
-        select(BotUserLink.telegram_chat_id)
-        .where(
-            BotUserLink.owner_user_id == owner_user_id,
-            BotUserLink.is_blocked == False,  # noqa: E712
-        )
-        .order_by(BotUserLink.id.desc())
-        .limit(1)
-    )
-    return (await db.execute(q)).scalar_one_or_none()
+@lru_cache(maxsize=64)
+def _tz(tz_name: str) -> ZoneInfo:
+    # таймзон у пользователей единицы — не парсим имя на каждый digest
+    return ZoneInfo(tz_name)
+
 
 def _tz_gmt_label(tz: ZoneInfo, dt_utc: datetime) -> str:
     # dt_utc ожидаем aware UTC
     offset = tz.utcoffset(dt_utc)
     if offset is None:
         return "GMT"
-    total_min = int(offset.total_seconds() // 60)
+    return _gmt_label(int(offset.total_seconds() // 60))
+
+
+@lru_cache(maxsize=128)
+def _gmt_label(total_min: int) -> str:
     sign = "+" if total_min >= 0 else "-"
     total_min = abs(total_min)
     hh = total_min // 60
@@ -161,7 +191,7 @@ def format_period_variant_f(
     - один день: "10 января 2026 (суббота), 04:00–10:00 (GMT+5)" / EN-аналог
     - разные дни: "9 января 2026 (пятница) 23:00 — 10 января 2026 (суббота) 11:00 (GMT+5)"
     """
-    tz = ZoneInfo(tz_name)
+    tz = _tz(tz_name)
 
     # нормализуем: должны быть aware
     if window_start_utc.tzinfo is None:
@@ -186,50 +216,96 @@ def format_period_variant_f(
 # -----------------------------
 # MATCH EVENTS pipeline
 # -----------------------------
-async def _reserve_match_events(db, now_utc: datetime) -> list[int]:
+async def _reserve_match_events(db) -> list:
     """
-    Reserve oldest queued match_events:
-      queued -> sending
-    Возвращаем список id зарезервированных событий.
+    Reserve queued match_events одним запросом (один round-trip, без
+    отдельного SELECT и повторной проверки статуса):
+      UPDATE ... SET notify_status='sending'
+      WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED)
+      RETURNING <поля для сообщения>
+
+    SKIP LOCKED — параллельные раннеры не заберут одни и те же события.
+    Забираем FIFO по id: иначе LIMIT всегда брал бы младшие subscription_id,
+    и загруженная подписка держала бы очередь остальных. Порядок совпадает
+    с partial index ix_match_events_queued_id (id) WHERE notify_status='queued',
+    так что LIMIT дочитывает индекс без сортировки.
+    Группировка по подписке — уже в Python: возвращаем строки,
+    отсортированные по (subscription_id, id).
     """
-    q = (
+    claim_q = (
         select(MatchEvent.id)
         .where(MatchEvent.notify_status == STATUS_QUEUED)
+        # FIFO: самые старые события первыми, без приоритета по subscription_id
         .order_by(MatchEvent.id.asc())
         .limit(BATCH_LIMIT)
+        .with_for_update(skip_locked=True)
     )
-    ids = [int(x) for x in (await db.execute(q)).scalars().all()]
-    if not ids:
-        return []
-
-    # переводим в sending только те, что всё ещё queued
-    await db.execute(
+    q = (
         update(MatchEvent)
-        .where(MatchEvent.id.in_(ids), MatchEvent.notify_status == STATUS_QUEUED)
+        .where(MatchEvent.id.in_(claim_q))
         .values(notify_status=STATUS_SENDING)
+        .returning(
+            MatchEvent.id,
+            MatchEvent.subscription_id,
+            MatchEvent.message_id,
+            MatchEvent.message_ts,
+            MatchEvent.author_id,
+            MatchEvent.author_display,
+            MatchEvent.excerpt,
+        )
+        .execution_options(synchronize_session=False)
     )
+    rows = list((await db.execute(q)).all())
     await db.commit()
-    return ids
 
+    # RETURNING не гарантирует порядок
+    rows.sort(key=lambda r: (r.subscription_id, r.id))
+    return rows
+
+
+# Колонки Subscription, которые читает dispatch (форматирование + UsageEvent).
+# Грузим их Core-строками, без ORM-сущностей и identity map; новое поле
+# в форматтере — добавить сюда.
+_SUB_DISPATCH_COLUMNS = (
+    Subscription.id,
+    Subscription.owner_user_id,
+    Subscription.name,
+    Subscription.source_mode,
+    Subscription.subscription_type,
+    Subscription.chat_ref,
+    Subscription.chat_id,
+)
 
-async def _load_match_events_with_subscriptions(db, event_ids: list[int]):
+
+async def _load_subscriptions_with_owners(
+    db, sub_ids: set[int]
+) -> tuple[dict[int, sa.Row], dict[int, sa.Row]]:
     """
-    Подтягиваем MatchEvent + Subscription + User одним запросом.
-    User нужен, чтобы знать `user.language` для wrapper-литералов.
+    Подписки одним IN-запросом (каждая ровно один раз, без дублей в JOIN).
+    User нужен, чтобы знать `user.language` для wrapper-литералов —
+    FK subscriptions -> users нет, поэтому отдельный IN по owner_user_id.
     """
-    q = (
-        select(MatchEvent, Subscription, User)
-        .join(Subscription, Subscription.id == MatchEvent.subscription_id)
-        .join(User, User.id == Subscription.owner_user_id)
-        .where(MatchEvent.id.in_(event_ids))
-        .order_by(MatchEvent.subscription_id.asc(), MatchEvent.id.asc())
-    )
-    return list((await db.execute(q)).all())
+    if not sub_ids:
+        return {}, {}
+
+    subs = (await db.execute(
+        select(*_SUB_DISPATCH_COLUMNS).where(Subscription.id.in_(sub_ids))
+    )).all()
+    subs_by_id = {int(s.id): s for s in subs}
+
+    owner_ids = {int(s.owner_user_id) for s in subs if s.owner_user_id}
+    users_by_id: dict[int, sa.Row] = {}
+    if owner_ids:
+        users = (await db.execute(
+            select(User.id, User.language, User.timezone).where(User.id.in_(owner_ids))
+        )).all()
+        users_by_id = {int(u.id): u for u in users}
+    return subs_by_id, users_by_id
 
 
 def _format_match_events_message(
-    sub: Subscription,
-    events: list[MatchEvent],
+    sub: sa.Row,
+    events: list,
     language: str = "en",
 ) -> str:
     """
@@ -251,11 +327,27 @@ def _format_match_events_message(
     text_parts: list[str] = [header]
     used = len(header)
 
-    detailed_indexes: list[int] = []
-    remaining_indexes: list[int] = []
+    # префикс ссылки зависит только от подписки — считаем один раз
+    link_prefix = build_tg_chat_link_prefix(
+        getattr(sub, "chat_ref", None),
+        getattr(sub, "chat_id", None),
+    )
+
+    # (idx, url, message_id) для секции ссылок — url считаем один раз за событие
+    remaining: list[tuple[int, str | None, int]] = []
 
     # 1) Сначала пытаемся набить подробную часть
     for idx, ev in enumerate(events, start=1):
+        message_id = int(ev.message_id)
+        url = f"{link_prefix}{message_id}" if link_prefix and message_id else None
+
+        # самый короткий блок: "\n{idx}) — • —\n—" (+7 к префиксу). Если и он
+        # уже не влезает, не форматируем excerpt/ts зря — сразу в ссылки.
+        # idx только растёт, так что дальше тоже не влезет ничего.
+        if used + len(str(idx)) + 10 > DETAIL_TEXT_LIMIT:
+            remaining.append((idx, url, message_id))
+            continue
+
         author = ev.author_display or (str(ev.author_id) if ev.author_id else "—")
         ts = ev.message_ts.isoformat() if ev.message_ts else "—"
 
@@ -263,11 +355,6 @@ def _format_match_events_message(
         if len(excerpt) > 300:
             excerpt = excerpt[:300].rstrip() + "…"
 
-        url = build_tg_message_link(
-            chat_ref=getattr(sub, "chat_ref", None),
-            chat_id=getattr(sub, "chat_id", None),
-            message_id=int(ev.message_id),
-        )
         link_text = f"\n{url}" if url else ""
 
         block = f"\n{idx}) {author} • {ts}\n{excerpt or '—'}{link_text}"
@@ -276,36 +363,33 @@ def _format_match_events_message(
         if used + len(block) <= DETAIL_TEXT_LIMIT:
             text_parts.append(block)
             used += len(block)
-            detailed_indexes.append(idx)
         else:
-            remaining_indexes.append(idx)
+            remaining.append((idx, url, message_id))
 
     # 2) Если осталось что-то — добавляем секцию ссылок
-    if remaining_indexes:
+    if remaining:
         tail_header = bot_t("remaining_links_header", language)
         if used + len(tail_header) < TG_MSG_HARD_LIMIT:
             text_parts.append(tail_header)
             used += len(tail_header)
 
-        for idx in remaining_indexes:
-            ev = events[idx - 1]
-            url = build_tg_message_link(
-                chat_ref=getattr(sub, "chat_ref", None),
-                chat_id=getattr(sub, "chat_id", None),
-                message_id=int(ev.message_id),
-            )
-            # если ссылку построить нельзя — хотя бы покажем message_id
-            line = f"\n{idx}) {url}" if url else f"\n{idx}) message_id={int(ev.message_id)}"
-
-            if used + len(line) <= TG_MSG_HARD_LIMIT:
-                text_parts.append(line)
-                used += len(line)
-            else:
-                # если даже ссылки уже не влезают — честно сообщаем
-                ell = bot_t("tg_limit_truncated", language)
-                if used + len(ell) <= TG_MSG_HARD_LIMIT:
-                    text_parts.append(ell)
-                break
+        # если ссылку построить нельзя — хотя бы покажем message_id
+        lines = [
+            f"\n{idx}) {url}" if url else f"\n{idx}) message_id={message_id}"
+            for idx, url, message_id in remaining
+        ]
+        # сколько строк влезает целиком: бинпоиск по накопленным длинам
+        cum_lens = list(accumulate(map(len, lines)))
+        cut = bisect_right(cum_lens, TG_MSG_HARD_LIMIT - used)
+        text_parts.extend(lines[:cut])
+        if cut:
+            used += cum_lens[cut - 1]
+
+        if cut < len(lines):
+            # если даже ссылки уже не влезают — честно сообщаем
+            ell = bot_t("tg_limit_truncated", language)
+            if used + len(ell) <= TG_MSG_HARD_LIMIT:
+                text_parts.append(ell)
 
     text = "".join(text_parts)
 
@@ -317,59 +401,77 @@ def _format_match_events_message(
 
 
 async def _mark_match_events(db, ids: list[int], status: str) -> None:
-    if not ids:
-        return
-    await db.execute(
-        update(MatchEvent)
-        .where(MatchEvent.id.in_(ids))
-        .values(notify_status=status)
-    )
-    await db.commit()
+    """Только UPDATE, без commit — коммитит _commit_outcomes."""
+    for i in range(0, len(ids), MARK_CHUNK_SIZE):
+        await db.execute(
+            update(MatchEvent)
+            .where(MatchEvent.id == sa.any_(sa.literal(ids[i:i + MARK_CHUNK_SIZE], ARRAY(sa.Integer))))
+            .values(notify_status=status)
+        )
 
 
 # -----------------------------
 # DIGEST EVENTS pipeline (Summary)
 # -----------------------------
-async def _reserve_digest_events(db, now_utc: datetime) -> list[int]:
+async def _reserve_digest_events(db) -> list:
     """
-    Reserve oldest queued digest_events:
-      queued -> sending
-    Возвращаем список id зарезервированных digest событий.
+    Reserve oldest queued digest_events (queued -> sending) одним
+    UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED)
+    RETURNING <поля для сообщения> — как у match_events, без отдельного
+    SELECT после резерва.
+    Возвращаем строки событий, отсортированные по (subscription_id, id).
     """
-    q = (
+    claim_q = (
         select(DigestEvent.id)
         .where(DigestEvent.notify_status == STATUS_QUEUED)
+        # FIFO по ix_digest_events_queued_id
         .order_by(DigestEvent.id.asc())
         .limit(BATCH_LIMIT)
+        .with_for_update(skip_locked=True)
     )
-    ids = [int(x) for x in (await db.execute(q)).scalars().all()]
-    if not ids:
-        return []
-
-    await db.execute(
+    q = (
         update(DigestEvent)
-        .where(DigestEvent.id.in_(ids), DigestEvent.notify_status == STATUS_QUEUED)
+        .where(DigestEvent.id.in_(claim_q))
         .values(notify_status=STATUS_SENDING)
+        .returning(
+            DigestEvent.id,
+            DigestEvent.subscription_id,
+            DigestEvent.window_start,
+            DigestEvent.window_end,
+            DigestEvent.digest_text,
+        )
+        .execution_options(synchronize_session=False)
     )
+    rows = list((await db.execute(q)).all())
     await db.commit()
-    return ids
 
+    # RETURNING не гарантирует порядок
+    rows.sort(key=lambda r: (r.subscription_id, r.id))
+    return rows
 
-async def _load_digest_events_with_subscriptions(db, event_ids: list[int]):
-    q = (
-        select(DigestEvent, Subscription, User)
-        .join(Subscription, Subscription.id == DigestEvent.subscription_id)
-        .join(User, User.id == Subscription.owner_user_id)
-        .where(DigestEvent.id.in_(event_ids))
-        .order_by(DigestEvent.subscription_id.asc(), DigestEvent.id.asc())
+
+async def _load_digest_events_with_subscriptions(db, events: list):
+    """
+    К уже зарезервированным строкам DigestEvent (RETURNING) добираем
+    подписки и владельцев IN-запросами (без дублирования Subscription/User
+    в каждой строке). Всё — Core-строки только с нужными колонками.
+    Возвращаем [(ev, sub | None, user | None), ...].
+    """
+    subs_by_id, users_by_id = await _load_subscriptions_with_owners(
+        db, {int(ev.subscription_id) for ev in events}
     )
-    return list((await db.execute(q)).all())
+    rows = []
+    for ev in events:
+        sub = subs_by_id.get(int(ev.subscription_id))
+        owner = getattr(sub, "owner_user_id", None)
+        rows.append((ev, sub, users_by_id.get(int(owner)) if owner else None))
+    return rows
 
 
 def _format_digest_message(
-    sub: Subscription,
-    ev: DigestEvent,
-    user: User,
+    sub: sa.Row,
+    ev: sa.Row,
+    user: sa.Row | None,
     language: str = "en",
 ) -> str:
     """
@@ -394,8 +496,14 @@ def _format_digest_message(
 
     body = (ev.digest_text or "").strip() or "—"
 
+    # режем body до склейки: длинный digest не копируем целиком дважды
+    budget = TG_MSG_HARD_LIMIT - len(title) - len(period) - 3
+    if len(body) > budget > 0:
+        body = body[: budget - 1] + "…"
+
     text = f"{title}\n{period}\n\n{body}"
 
+    # финальная страховка (на случай гигантского title/period)
     if len(text) > TG_MSG_HARD_LIMIT:
         text = text[: TG_MSG_HARD_LIMIT - 1] + "…"
 
@@ -403,189 +511,368 @@ def _format_digest_message(
 
 
 async def _mark_digest_events(db, ids: list[int], status: str) -> None:
-    if not ids:
+    """Только UPDATE, без commit — коммитит _commit_outcomes."""
+    for i in range(0, len(ids), MARK_CHUNK_SIZE):
+        await db.execute(
+            update(DigestEvent)
+            .where(DigestEvent.id == sa.any_(sa.literal(ids[i:i + MARK_CHUNK_SIZE], ARRAY(sa.Integer))))
+            .values(notify_status=status)
+        )
+
+
+# -----------------------------
+# Batched outcome commit
+# -----------------------------
+async def _commit_outcomes(
+    db,
+    mark,
+    sent_ids: list[int],
+    failed_ids: list[int],
+    requeued_ids: list[int],
+    label: str,
+) -> None:
+    """
+    Один раз за фазу: UPDATE на каждый исход (sent / failed / обратно в
+    queued после flood control) + один commit вместо UPDATE+commit на
+    каждую группу.
+
+    Если commit упал (например, из-за UsageEvent), откатываемся и
+    повторяем только статусы — иначе события навсегда зависнут в 'sending'.
+    """
+    try:
+        await mark(db, sent_ids, STATUS_SENT)
+        await mark(db, failed_ids, STATUS_FAILED)
+        await mark(db, requeued_ids, STATUS_QUEUED)
+        await db.commit()
         return
-    await db.execute(
-        update(DigestEvent)
-        .where(DigestEvent.id.in_(ids))
-        .values(notify_status=status)
-    )
+    except SQLAlchemyError as e:
+        log.warning("%s_COMMIT_FAILED err=%s; retrying statuses only", label, e)
+        await db.rollback()
+
+    await mark(db, sent_ids, STATUS_SENT)
+    await mark(db, failed_ids, STATUS_FAILED)
+    await mark(db, requeued_ids, STATUS_QUEUED)
     await db.commit()
 
 
 # -----------------------------
-# Runner
+# Parallel send
 # -----------------------------
-async def run_tick() -> int:
+@dataclass
+class _SendLimits:
+    """Лимиты отправки на один тик — общие для обеих фаз."""
+    sem: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(SEND_CONCURRENCY))
+    chat_locks: dict[int, asyncio.Lock] = field(default_factory=dict)
+    last_sent: dict[int, float] = field(default_factory=dict)
+    # monotonic-время, раньше которого следующий запрос в Bot API не стартует
+    next_send_at: float = 0.0
+
+
+async def _wait_global_slot(limits: _SendLimits) -> None:
     """
-    ВАЖНО: без вложенных db.begin().
+    Глобальный темп SEND_RATE_PER_SEC: семафор ограничивает только число
+    запросов в полёте, а при RTT ~100 мс 10 параллельных — это уже ~100 msg/s.
+    Слот бронируем без lock: между чтением и записью next_send_at нет await.
+    """
+    now = time.monotonic()
+    slot = max(now, limits.next_send_at)
+    limits.next_send_at = slot + 1.0 / SEND_RATE_PER_SEC
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
 
-    Схема:
-      1) match_events: reserve -> load -> send -> mark sent/failed
-      2) digest_events: reserve -> load -> send -> mark sent/failed
+async def _send_one(limits: _SendLimits, job: dict) -> tuple[int, Exception | None]:
+    """
+    bot_send_message под семафором и глобальным темпом. Возвращает
+    (elapsed_ms, ошибка | None): исключение не пробрасываем, чтобы один
+    упавший чат не ронял остальные.
+    """
+    async with limits.sem:
+        t0 = time.perf_counter()
+        try:
+            if not job["dest_chat_id"]:
+                raise RuntimeError(f"NO_BOT_USER_LINK owner_user_id={job['owner_user_id']}")
+            for attempt in range(1, SEND_MAX_ATTEMPTS + 1):
+                await _wait_global_slot(limits)
+                try:
+                    await bot_send_message(chat_id=int(job["dest_chat_id"]), text=job["text"])
+                    break
+                except BotRetryAfter as e:
+                    # слот семафора держим: flood control глобальный,
+                    # остальным отправкам тоже стоит подождать
+                    if attempt == SEND_MAX_ATTEMPTS or e.retry_after > SEND_MAX_RETRY_AFTER_SEC:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+            return int((time.perf_counter() - t0) * 1000), None
+        except Exception as e:  # noqa: BLE001
+            return int((time.perf_counter() - t0) * 1000), e
+
+
+async def _send_bounded(limits: _SendLimits, job: dict) -> tuple[int, Exception | None]:
+    """
+    Per-chat очередь поверх глобального семафора: в один чат — не чаще
+    PER_CHAT_MIN_INTERVAL_SEC. Ждём на локе чата, не занимая слот семафора,
+    так что разные чаты друг друга не тормозят.
+    """
+    dest = job["dest_chat_id"]
+    if not dest:
+        return await _send_one(limits, job)
+
+    async with limits.chat_locks.setdefault(dest, asyncio.Lock()):
+        wait = limits.last_sent.get(dest, 0.0) + PER_CHAT_MIN_INTERVAL_SEC - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await _send_one(limits, job)
+        finally:
+            limits.last_sent[dest] = time.monotonic()
+
+
+def _bundle_match_parts(parts: list[dict]) -> list[dict]:
+    """
+    Готовые сообщения подписок одного владельца жадно пакуем в бакеты
+    <= TG_MSG_HARD_LIMIT: один sendMessage вместо одного на подписку —
+    меньше запросов к Bot API, меньше 429 и ожиданий per-chat интервала.
+    Порядок подписок внутри владельца сохраняется.
     """
-    now_utc = _utc_now()
+    by_owner: dict[int, list[dict]] = {}
+    for part in parts:
+        by_owner.setdefault(part["owner_user_id"], []).append(part)
+
+    jobs: list[dict] = []
+    for owner_user_id, owner_parts in by_owner.items():
+        bucket: list[dict] = []
+        size = 0
+        for part in owner_parts:
+            n = len(part["text"])
+            if bucket and size + len(MATCH_BUNDLE_SEPARATOR) + n > TG_MSG_HARD_LIMIT:
+                jobs.append(_match_bundle_job(owner_user_id, bucket))
+                bucket, size = [], 0
+            size += (len(MATCH_BUNDLE_SEPARATOR) if bucket else 0) + n
+            bucket.append(part)
+        if bucket:
+            jobs.append(_match_bundle_job(owner_user_id, bucket))
+    return jobs
+
+
+def _match_bundle_job(owner_user_id: int, bucket: list[dict]) -> dict:
+    return {
+        "owner_user_id": owner_user_id,
+        "dest_chat_id": bucket[0]["dest_chat_id"],
+        "parts": bucket,
+        "text": MATCH_BUNDLE_SEPARATOR.join(p["text"] for p in bucket),
+    }
+
+
+async def _send_all(jobs: list[dict], limits: _SendLimits) -> list[tuple[int, Exception | None]]:
+    """Шлём все подготовленные сообщения параллельно (без обращений к БД)."""
+    if not jobs:
+        return []
+    return await asyncio.gather(*(_send_bounded(limits, job) for job in jobs))
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+async def _match_pipeline(limits: _SendLimits) -> int:
+    """MatchEvent-фаза тика: reserve -> load -> send -> mark. Возвращает exit code."""
     exit_code = 0
 
-    # -------------------------
-    # 1) MATCH EVENTS
-    # -------------------------
+    # копим исходы и пишем их одним батчем после отправки
+    sent_ids: list[int] = []
+    failed_ids: list[int] = []
+    requeued_ids: list[int] = []
+    usage_events: list[dict] = []
+    parts: list[dict] = []
+
+    # reserve + load в одной сессии: между ними нет HTTP, незачем
+    # возвращать соединение в пул и брать заново
     async with AsyncSessionLocal() as db:
         try:
-            match_ids = await _reserve_match_events(db, now_utc)
+            match_rows = await _reserve_match_events(db)
         except SQLAlchemyError as e:
-            print(f"[notifications_runner] MATCH_RESERVE_FAILED: {e}")
+            log.error("MATCH_RESERVE_FAILED: %s", e)
             return 2
 
-    if match_ids:
-        async with AsyncSessionLocal() as db:
-            rows = await _load_match_events_with_subscriptions(db, match_ids)
+        if match_rows:
+            subs_by_id, users_by_id = await _load_subscriptions_with_owners(
+                db, {int(r.subscription_id) for r in match_rows}
+            )
 
-            # группировка: (owner_user_id, subscription_id) -> {sub, user, events[]}
-            grouped: dict[tuple[int, int], dict] = {}
-            for ev, sub, user in rows:
+            # группировка: [(owner_user_id, subscription_id, sub, user, events[])]
+            # события уже отсортированы по subscription_id, так что хватает groupby
+            # и плоского списка — ключи уникальны, dict-упаковка не нужна
+            grouped: list[tuple[int, int, sa.Row, sa.Row | None, list]] = []
+            for sid, group in groupby(match_rows, key=attrgetter("subscription_id")):
+                group_events = list(group)
+                sub = subs_by_id.get(int(sid))
                 owner_user_id = getattr(sub, "owner_user_id", None)
                 if not owner_user_id:
                     # Некорректная подписка — нельзя понять, кому слать.
-                    print(f"[notifications_runner] MATCH_SKIP sub_id={sub.id} reason=NO_OWNER_USER_ID")
+                    log.warning("MATCH_SKIP sub_id=%s reason=NO_OWNER_USER_ID", sid)
                     # Помечаем события failed, чтобы не зациклились
-                    await _mark_match_events(db, [int(ev.id)], STATUS_FAILED)
+                    failed_ids.extend(int(ev.id) for ev in group_events)
                     continue
                 owner_user_id = int(owner_user_id)
-                sid = int(ev.subscription_id)
-                key = (owner_user_id, sid)
-                grouped.setdefault(key, {"sub": sub, "user": user, "events": []})
-                grouped[key]["events"].append(ev)
-
-            for (owner_user_id, sid), pack in grouped.items():
-                sub: Subscription = pack["sub"]
-                user: User = pack["user"]
-                events: list[MatchEvent] = pack["events"]
-                language = getattr(user, "language", None) or "en"
-                events_in_group = len(events)
-                sub_source_mode = getattr(sub, "source_mode", None)
-                sub_chat_ref = getattr(sub, "chat_ref", None)
+                grouped.append((
+                    owner_user_id, int(sid), sub, users_by_id.get(owner_user_id), group_events,
+                ))
+
+            chat_by_owner = await get_bot_dest_chat_ids(db, {g[0] for g in grouped})
+
+            for owner_user_id, sid, sub, user, events in grouped:
+                language = (user.language if user is not None else None) or "en"
+                # поля UsageEvent от подписки — один раз на группу, дальше только dict(usage, ...)
+                usage = dict(
+                    owner_user_id=owner_user_id,
+                    subscription_id=sid,
+                    source_mode=sub.source_mode,
+                    chat_ref=sub.chat_ref,
+                )
 
                 # если тип подписки не events — помечаем failed
-                sub_type = (getattr(sub, "subscription_type", None) or "events").lower()
+                sub_type = (sub.subscription_type or "events").lower()
                 if sub_type != "events":
-                    await _mark_match_events(db, [int(e.id) for e in events], STATUS_FAILED)
+                    failed_ids.extend(int(e.id) for e in events)
                     exit_code = 1
-                    print(f"[notifications_runner] MATCH_FAILED_UNKNOWN_TYPE owner_user_id={owner_user_id} sub_id={sid}")
-                    await _record_bot_dispatch_event(
-                        db,
-                        owner_user_id=owner_user_id,
-                        subscription_id=sid,
-                        source_mode=sub_source_mode,
-                        chat_ref=sub_chat_ref,
+                    log.warning("MATCH_FAILED_UNKNOWN_TYPE owner_user_id=%s sub_id=%s", owner_user_id, sid)
+                    usage_events.append(dict(
+                        usage,
                         success=False,
                         meta={
                             "subscription_type": sub_type,
-                            "events_in_group": events_in_group,
+                            "events_in_group": len(events),
                             "error_code": "WRONG_SUBSCRIPTION_TYPE_FOR_MATCH_DISPATCH",
                             "error_message": f"expected events, got {sub_type}",
                         },
-                    )
+                    ))
                     continue
 
-                group_t0 = time.perf_counter()
-                try:
-                    dest_chat_id = await _get_dest_chat_id(db, owner_user_id)
-                    if not dest_chat_id:
-                        raise RuntimeError(f"NO_BOT_USER_LINK owner_user_id={owner_user_id}")
-
-                    text = _format_match_events_message(sub, events, language=language)
-                    await bot_send_message(chat_id=int(dest_chat_id), text=text)
-
-                    await _mark_match_events(db, [int(e.id) for e in events], STATUS_SENT)
-                    elapsed_ms = int((time.perf_counter() - group_t0) * 1000)
-                    print(
-                        f"[notifications_runner] MATCH_SENT owner_user_id={owner_user_id} "
-                        f"sub_id={sid} events={events_in_group}"
-                    )
-                    await _record_bot_dispatch_event(
-                        db,
-                        owner_user_id=owner_user_id,
-                        subscription_id=sid,
-                        source_mode=sub_source_mode,
-                        chat_ref=sub_chat_ref,
+                parts.append({
+                    "owner_user_id": owner_user_id,
+                    "sid": sid,
+                    "usage": usage,
+                    "events": events,
+                    "dest_chat_id": chat_by_owner.get(owner_user_id),
+                    "text": _format_match_events_message(sub, events, language=language),
+                })
+
+    if match_rows:
+        # сессия закрыта — соединение вернулось в пул на время HTTP к Telegram
+        jobs = _bundle_match_parts(parts)
+        results = await _send_all(jobs, limits)
+
+        for job, (elapsed_ms, err) in zip(jobs, results):
+            owner_user_id = job["owner_user_id"]
+            parts_in_message = len(job["parts"])
+            if err is not None:
+                exit_code = 1
+
+            # исход сообщения — общий для всех подписок, склеенных в него
+            for part in job["parts"]:
+                sid = part["sid"]
+                events = part["events"]
+                events_in_group = len(events)
+                usage = part["usage"]
+
+                if err is None:
+                    sent_ids.extend(int(e.id) for e in events)
+                    log.info("MATCH_SENT owner_user_id=%s sub_id=%s events=%d", owner_user_id, sid, events_in_group)
+                    usage_events.append(dict(
+                        usage,
                         success=True,
                         meta={
                             "subscription_type": "events",
                             "events_in_group": events_in_group,
+                            "parts_in_message": parts_in_message,
                             "elapsed_ms": elapsed_ms,
                         },
-                    )
-
-                except Exception as e:
-                    await _mark_match_events(db, [int(e.id) for e in events], STATUS_FAILED)
-                    elapsed_ms = int((time.perf_counter() - group_t0) * 1000)
-                    exit_code = 1
-                    print(
-                        f"[notifications_runner] MATCH_SEND_FAILED owner_user_id={owner_user_id} "
-                        f"sub_id={sid} err={e}"
-                    )
-                    await _record_bot_dispatch_event(
-                        db,
-                        owner_user_id=owner_user_id,
-                        subscription_id=sid,
-                        source_mode=sub_source_mode,
-                        chat_ref=sub_chat_ref,
+                    ))
+                else:
+                    if isinstance(err, BotRetryAfter):
+                        # не теряем: следующий тик заберёт снова
+                        requeued_ids.extend(int(ev.id) for ev in events)
+                    else:
+                        failed_ids.extend(int(ev.id) for ev in events)
+                    log.warning("MATCH_SEND_FAILED owner_user_id=%s sub_id=%s err=%s", owner_user_id, sid, err)
+                    usage_events.append(dict(
+                        usage,
                         success=False,
                         meta={
                             "subscription_type": "events",
                             "events_in_group": events_in_group,
+                            "parts_in_message": parts_in_message,
                             "elapsed_ms": elapsed_ms,
-                            "error_code": _derive_dispatch_error_code(e),
-                            "error_message": (str(e) or "")[:300] or None,
+                            "error_code": _derive_dispatch_error_code(err),
+                            "error_message": (str(err) or "")[:300] or None,
                         },
-                    )
+                    ))
+
+        async with AsyncSessionLocal() as db:
+            for kw in usage_events:
+                await _record_bot_dispatch_event(db, **kw)
+            await _commit_outcomes(db, _mark_match_events, sent_ids, failed_ids, requeued_ids, "MATCH")
 
     else:
-        print("[notifications_runner] No queued match_events")
+        log.info("No queued match_events")
+
+    return exit_code
+
+
+async def _digest_pipeline(limits: _SendLimits) -> int:
+    """DigestEvent-фаза тика: reserve -> load -> send -> mark. Возвращает exit code."""
+    exit_code = 0
+
+    sent_ids = []
+    failed_ids = []
+    requeued_ids = []
+    usage_events = []
+    jobs = []
 
-    # -------------------------
-    # 2) DIGEST EVENTS (Summary)
-    # -------------------------
     async with AsyncSessionLocal() as db:
         try:
-            digest_ids = await _reserve_digest_events(db, now_utc)
+            digest_rows = await _reserve_digest_events(db)
         except SQLAlchemyError as e:
-            print(f"[notifications_runner] DIGEST_RESERVE_FAILED: {e}")
+            log.error("DIGEST_RESERVE_FAILED: %s", e)
             return 2
 
-    if digest_ids:
-        async with AsyncSessionLocal() as db:
-            rows = await _load_digest_events_with_subscriptions(db, digest_ids)
+        if digest_rows:
+            rows = await _load_digest_events_with_subscriptions(db, digest_rows)
+            chat_by_owner = await get_bot_dest_chat_ids(
+                db, {sub.owner_user_id for _, sub, _ in rows if getattr(sub, "owner_user_id", None)}
+            )
 
             for ev, sub, user in rows:
                 owner_user_id = getattr(sub, "owner_user_id", None)
-                sub_source_mode = getattr(sub, "source_mode", None)
-                sub_chat_ref = getattr(sub, "chat_ref", None)
-                digest_event_id = int(ev.id) if ev is not None else None
+                digest_event_id = int(ev.id)
 
                 if not owner_user_id:
                     # Misconfigured subscription — can't even attribute a
                     # UsageEvent (user_id NOT NULL). Just mark failed.
-                    print(f"[notifications_runner] DIGEST_SKIP sub_id={sub.id} ev_id={ev.id} reason=NO_OWNER_USER_ID")
-                    await _mark_digest_events(db, [int(ev.id)], STATUS_FAILED)
+                    log.warning("DIGEST_SKIP sub_id=%s ev_id=%s reason=NO_OWNER_USER_ID", ev.subscription_id, ev.id)
+                    failed_ids.append(digest_event_id)
                     continue
                 owner_user_id = int(owner_user_id)
                 sid = int(ev.subscription_id)
-
-                sub_type = (getattr(sub, "subscription_type", None) or "").lower()
+                usage = dict(
+                    owner_user_id=owner_user_id,
+                    subscription_id=sid,
+                    source_mode=sub.source_mode,
+                    chat_ref=sub.chat_ref,
+                )
+
+                sub_type = (sub.subscription_type or "").lower()
                 # ВАЖНО: название типа у тебя может быть "summary" или "digest" — оставляю поддержку обоих
                 # (ты сама решишь итоговый enum; если у тебя строго "summary" — можно оставить только его)
                 if sub_type not in ("summary", "digest"):
-                    await _mark_digest_events(db, [int(ev.id)], STATUS_FAILED)
+                    failed_ids.append(digest_event_id)
                     exit_code = 1
-                    print(f"[notifications_runner] DIGEST_FAILED_UNKNOWN_TYPE owner_user_id={owner_user_id} sub_id={sid} ev_id={ev.id}")
-                    await _record_bot_dispatch_event(
-                        db,
-                        owner_user_id=owner_user_id,
-                        subscription_id=sid,
-                        source_mode=sub_source_mode,
-                        chat_ref=sub_chat_ref,
+                    log.warning(
+                        "DIGEST_FAILED_UNKNOWN_TYPE owner_user_id=%s sub_id=%s ev_id=%s",
+                        owner_user_id, sid, ev.id,
+                    )
+                    usage_events.append(dict(
+                        usage,
                         success=False,
                         meta={
                             "subscription_type": "digest",
@@ -593,71 +880,161 @@ async def run_tick() -> int:
                             "error_code": "WRONG_SUBSCRIPTION_TYPE_FOR_DIGEST_DISPATCH",
                             "error_message": f"expected summary/digest, got {sub_type or 'empty'}",
                         },
-                    )
+                    ))
                     continue
 
-                group_t0 = time.perf_counter()
-                try:
-                    dest_chat_id = await _get_dest_chat_id(db, owner_user_id)
-                    if not dest_chat_id:
-                        raise RuntimeError(f"NO_BOT_USER_LINK owner_user_id={owner_user_id}")
-
-                    language = getattr(user, "language", None) or "en"
-                    text = _format_digest_message(sub, ev, user, language=language)
-                    await bot_send_message(chat_id=int(dest_chat_id), text=text)
-
-                    await _mark_digest_events(db, [int(ev.id)], STATUS_SENT)
-                    elapsed_ms = int((time.perf_counter() - group_t0) * 1000)
-                    print(
-                        f"[notifications_runner] DIGEST_SENT owner_user_id={owner_user_id} "
-                        f"sub_id={sid} ev_id={ev.id}"
-                    )
-                    await _record_bot_dispatch_event(
-                        db,
-                        owner_user_id=owner_user_id,
-                        subscription_id=sid,
-                        source_mode=sub_source_mode,
-                        chat_ref=sub_chat_ref,
-                        success=True,
-                        meta={
-                            "subscription_type": "digest",
-                            "digest_event_id": digest_event_id,
-                            "elapsed_ms": elapsed_ms,
-                        },
-                    )
+                language = getattr(user, "language", None) or "en"
+                jobs.append({
+                    "owner_user_id": owner_user_id,
+                    "sid": sid,
+                    "usage": usage,
+                    "ev_id": digest_event_id,
+                    "dest_chat_id": chat_by_owner.get(owner_user_id),
+                    "text": _format_digest_message(sub, ev, user, language=language),
+                })
+
+    if digest_rows:
+        results = await _send_all(jobs, limits)
+
+        for job, (elapsed_ms, err) in zip(jobs, results):
+            owner_user_id = job["owner_user_id"]
+            sid = job["sid"]
+            digest_event_id = job["ev_id"]
+            usage = job["usage"]
+
+            if err is None:
+                sent_ids.append(digest_event_id)
+                log.info("DIGEST_SENT owner_user_id=%s sub_id=%s ev_id=%s", owner_user_id, sid, digest_event_id)
+                usage_events.append(dict(
+                    usage,
+                    success=True,
+                    meta={
+                        "subscription_type": "digest",
+                        "digest_event_id": digest_event_id,
+                        "elapsed_ms": elapsed_ms,
+                    },
+                ))
+            else:
+                if isinstance(err, BotRetryAfter):
+                    # не теряем: следующий тик заберёт снова
+                    requeued_ids.append(digest_event_id)
+                else:
+                    failed_ids.append(digest_event_id)
+                exit_code = 1
+                log.warning(
+                    "DIGEST_SEND_FAILED owner_user_id=%s sub_id=%s ev_id=%s err=%s",
+                    owner_user_id, sid, digest_event_id, err,
+                )
+                usage_events.append(dict(
+                    usage,
+                    success=False,
+                    meta={
+                        "subscription_type": "digest",
+                        "digest_event_id": digest_event_id,
+                        "elapsed_ms": elapsed_ms,
+                        "error_code": _derive_dispatch_error_code(err),
+                        "error_message": (str(err) or "")[:300] or None,
+                    },
+                ))
 
-                except Exception as e:
-                    await _mark_digest_events(db, [int(ev.id)], STATUS_FAILED)
-                    elapsed_ms = int((time.perf_counter() - group_t0) * 1000)
-                    exit_code = 1
-                    print(
-                        f"[notifications_runner] DIGEST_SEND_FAILED owner_user_id={owner_user_id} "
-                        f"sub_id={sid} ev_id={ev.id} err={e}"
-                    )
-                    await _record_bot_dispatch_event(
-                        db,
-                        owner_user_id=owner_user_id,
-                        subscription_id=sid,
-                        source_mode=sub_source_mode,
-                        chat_ref=sub_chat_ref,
-                        success=False,
-                        meta={
-                            "subscription_type": "digest",
-                            "digest_event_id": digest_event_id,
-                            "elapsed_ms": elapsed_ms,
-                            "error_code": _derive_dispatch_error_code(e),
-                            "error_message": (str(e) or "")[:300] or None,
-                        },
-                    )
+        async with AsyncSessionLocal() as db:
+            for kw in usage_events:
+                await _record_bot_dispatch_event(db, **kw)
+            await _commit_outcomes(db, _mark_digest_events, sent_ids, failed_ids, requeued_ids, "DIGEST")
 
     else:
-        print("[notifications_runner] No queued digest_events")
+        log.info("No queued digest_events")
+
+    return exit_code
+
+
+async def run_tick() -> int:
+    """
+    ВАЖНО: без вложенных db.begin().
+
+    Фазы match_events и digest_events идут параллельно: таблицы у них
+    разные, и у каждой свои сессии (AsyncSession между задачами не делим).
+    Лимиты отправки (семафор + per-chat очередь) общие на тик — фазы шлют
+    в одни и те же чаты.
+
+    Схема каждой фазы, две сессии на фазу:
+      1) reserve (commit) + load и подготовка текстов — одна сессия
+      2) send — параллельно, соединение с БД в это время не держим
+      3) mark sent/failed + UsageEvent — короткая транзакция, один commit
+    """
+    limits = _SendLimits()
+
+    results = await asyncio.gather(
+        _match_pipeline(limits),
+        _digest_pipeline(limits),
+        return_exceptions=True,
+    )
 
+    exit_code = 0
+    for label, res in zip(("MATCH", "DIGEST"), results):
+        if isinstance(res, BaseException):
+            log.error("%s_PIPELINE_CRASHED", label, exc_info=res)
+            res = 2
+        exit_code = max(exit_code, res)
     return exit_code
 
 
+async def run_loop() -> None:
+    """
+    Долгоживущий воркер (Render background worker) вместо cron-процесса на
+    каждый тик: event loop, пул соединений и prepared statements
+    переживают тики, нет холодного старта на каждый запуск.
+    """
+    interval = int(os.getenv("NOTIFICATIONS_TICK_INTERVAL_SEC", "30"))
+
+    # прогрев пула: первое соединение + auth до первого тика
+    async with AsyncSessionLocal() as db:
+        await db.execute(sa.text("SELECT 1"))
+
+    try:
+        while True:
+            try:
+                await run_tick()
+            except Exception:  # noqa: BLE001
+                log.exception("TICK_CRASHED")
+            await asyncio.sleep(interval)
+    finally:
+        await close_bot_http_client()
+
+
+async def _run_once() -> int:
+    """Один тик (cron): keep-alive клиент Bot API закрываем до выхода из loop."""
+    try:
+        return await run_tick()
+    finally:
+        await close_bot_http_client()
+
+
+def _setup_logging() -> QueueListener:
+    """
+    Логи пишет фоновый поток: event loop только кладёт запись в очередь
+    и не блокируется на stdout/pipe, пока идут параллельные отправки.
+    """
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("[%(name)s] %(levelname)s %(message)s"))
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(q)])
+    listener = QueueListener(q, stream)
+    listener.start()
+    return listener
+
+
 def main():
-    code = asyncio.run(run_tick())
+    listener = _setup_logging()
+    try:
+        # `python -m jobs.notifications_runner --loop` — воркер; без флага — один тик (cron)
+        if "--loop" in sys.argv[1:]:
+            asyncio.run(run_loop())
+            return
+        code = asyncio.run(_run_once())
+    finally:
+        # дописать хвост очереди до выхода процесса
+        listener.stop()
     raise SystemExit(code)
 
 
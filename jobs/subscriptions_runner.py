@@ -1,28 +1,29 @@
 # jobs/subscriptions_runner.py
 import asyncio
+import logging
+import queue
 import sys
 import time
 from datetime import datetime, timezone, timedelta
+from logging.handlers import QueueHandler, QueueListener
 from typing import Any, Optional
 
-import sqlalchemy as sa
 from sqlalchemy import select, update, or_
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.dialects.postgresql import insert
 
 from db.session import AsyncSessionLocal
 from db.models import (
-    Subscription, SubscriptionState, MatchEvent, DigestEvent, User, UsageEvent,
+    Subscription, SubscriptionState, DigestEvent, User, UsageEvent,
 )
 import os
-from main import parse_iso_ts
+from main import parse_iso_ts, bulk_insert_match_events
 from llm.service import (
     classify_subscription_matches,
     build_subscription_digest,
 )
 from llm.usage import LlmUsage, split_usage_for_meta, TOKENS_SOURCE_EMPTY
 from llm.pricing import estimate_llm_cost_usd, cost_kwargs_for_meta
-from plan_limits import utc_now
 from telegram_service import fetch_chat_messages_for_subscription, disconnect_tg_client
 from service_account_service import fetch_service_chat_messages_for_subscription
 
@@ -30,6 +31,10 @@ BATCH_SIZE = 20
 EVENTS_READ_LIMIT = 1000  # как ты утвердила ранее для events
 LEASE_MINUTES = 5      # сколько держим "замок" на время обработки
 RETRY_MINUTES = 2      # через сколько повторять при ошибке
+# сколько подписок обрабатываем параллельно (fetch из Telegram + LLM — это I/O)
+SUB_CONCURRENCY = int(os.getenv("SUBSCRIPTIONS_CONCURRENCY", "5"))
+
+log = logging.getLogger("subscriptions_runner")
 
 
 # ---------------------------------------------------------------------------
@@ -47,7 +52,7 @@ RETRY_MINUTES = 2      # через сколько повторять при о
 #   - no messages fetched (LLM was not called)
 #
 # Failure events MUST be written in a fresh AsyncSession because the
-# main session is rolled back by run_tick() before the next sub runs.
+# main session is rolled back by _run_one_subscription() right after.
 # ---------------------------------------------------------------------------
 
 
@@ -159,7 +164,7 @@ async def _record_subscription_run_failed_new_session(
     """Write subscription_run_failed in a fresh AsyncSession.
 
     The caller's session is poisoned after the exception (rolled back
-    by run_tick), so we cannot reuse it. If we can't determine
+    by _run_one_subscription), so we cannot reuse it. If we can't determine
     owner_user_id we skip — UsageEvent requires user_id NOT NULL.
     """
     owner = metrics.get("owner_user_id")
@@ -192,10 +197,10 @@ async def _record_subscription_run_failed_new_session(
             )
             await db_log.commit()
     except Exception as log_err:  # noqa: BLE001
-        # Don't let logging hide the original error — print and move on.
-        print(
-            f"[subscriptions_runner] failed to log subscription_run_failed "
-            f"sub_id={metrics.get('subscription_id')} err={log_err}"
+        # Don't let logging hide the original error — log and move on.
+        log.warning(
+            "failed to log subscription_run_failed sub_id=%s err=%s",
+            metrics.get("subscription_id"), log_err,
         )
 
 
@@ -243,53 +248,52 @@ async def _record_subscription_run_success_same_session(
 
 
 # ---------------------------------------------------------------------------
-# Existing reservation logic — unchanged
+# Reservation logic
 # ---------------------------------------------------------------------------
 
-def _is_due(last_success_at, freq_min: int, now_utc: datetime) -> bool:
-    if last_success_at is None:
-        return True
-    return (now_utc - last_success_at) >= timedelta(minutes=freq_min)
-
-
-async def _reserve_due_subscriptions(db, now_utc: datetime) -> list[int]:
+async def _reserve_due_subscriptions(db, now_utc: datetime) -> list[tuple[int, Optional[int]]]:
     """
-    Короткая транзакция:
+    Одним запросом (UPDATE ... WHERE subscription_id IN (SELECT ... FOR
+    UPDATE SKIP LOCKED) RETURNING):
     - выбираем due подписки по next_run_at
-    - лочим строки subscription_state FOR UPDATE SKIP LOCKED
-    - резервируем: last_checked_at=now, next_run_at=now+freq
+    - лочим строки SKIP LOCKED — параллельный раннер их не возьмёт
+    - резервируем: last_checked_at=now, next_run_at=now+lease
     - коммит
+    Возвращаем [(subscription_id, owner_user_id), ...].
     """
-    async with db.begin():
-        q = (
-            select(SubscriptionState, Subscription)
-            .join(Subscription, Subscription.id == SubscriptionState.subscription_id)
-            .where(Subscription.is_active == True)  # noqa: E712
-            .where(
-                or_(
-                    SubscriptionState.next_run_at.is_(None),
-                    SubscriptionState.next_run_at <= now_utc,
-                )
+    claim_q = (
+        select(SubscriptionState.subscription_id)
+        .join(Subscription, Subscription.id == SubscriptionState.subscription_id)
+        .where(Subscription.is_active == True)  # noqa: E712
+        .where(
+            or_(
+                SubscriptionState.next_run_at.is_(None),
+                SubscriptionState.next_run_at <= now_utc,
             )
-            .with_for_update(skip_locked=True)
-            .order_by(
-                SubscriptionState.next_run_at.asc().nullsfirst(),
-                SubscriptionState.subscription_id.asc(),
-            )
-            .limit(BATCH_SIZE)
         )
-
+        .with_for_update(skip_locked=True)
+        .order_by(
+            SubscriptionState.next_run_at.asc().nullsfirst(),
+            SubscriptionState.subscription_id.asc(),
+        )
+        .limit(BATCH_SIZE)
+    )
+    q = (
+        update(SubscriptionState)
+        .where(SubscriptionState.subscription_id.in_(claim_q))
+        .where(Subscription.id == SubscriptionState.subscription_id)
+        .values(
+            last_checked_at=now_utc,
+            next_run_at=now_utc + timedelta(minutes=LEASE_MINUTES),
+        )
+        .returning(SubscriptionState.subscription_id, Subscription.owner_user_id)
+        .execution_options(synchronize_session=False)
+    )
+    async with db.begin():
         rows = (await db.execute(q)).all()
-        if not rows:
-            return []
-
-        due_ids: list[int] = []
-        for st, sub in rows:
-            st.last_checked_at = now_utc
-            st.next_run_at = now_utc + timedelta(minutes=LEASE_MINUTES)
-            due_ids.append(int(sub.id))
 
-        return due_ids
+    # порядок RETURNING не гарантирован — сортируем для стабильного порядка логов
+    return sorted((int(sid), owner) for sid, owner in rows)
 
 
 # ---------------------------------------------------------------------------
@@ -299,12 +303,24 @@ async def _reserve_due_subscriptions(db, now_utc: datetime) -> list[int]:
 async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
     metrics = _new_metrics(sub_id, run_t0=time.perf_counter())
 
-    sub = (await db.execute(select(Subscription).where(Subscription.id == sub_id))).scalar_one()
+    # подписка, её state и владелец — одним запросом вместо трёх
+    sub, st, owner = (
+        await db.execute(
+            select(Subscription, SubscriptionState, User)
+            .outerjoin(SubscriptionState, SubscriptionState.subscription_id == Subscription.id)
+            .outerjoin(User, User.id == Subscription.owner_user_id)
+            .where(Subscription.id == sub_id)
+        )
+    ).one()
 
     # Cache sub fields into metrics ASAP so the failure path has them.
+    # Инварианты подписки — в локальные переменные один раз: дальше (в том
+    # числе в цикле по матчам) без повторных InstrumentedAttribute.__get__.
+    chat_ref = sub.chat_ref
+    ai_model = sub.ai_model
     metrics["owner_user_id"] = getattr(sub, "owner_user_id", None)
-    metrics["chat_ref"] = getattr(sub, "chat_ref", None)
-    metrics["ai_model"] = getattr(sub, "ai_model", None)
+    metrics["chat_ref"] = chat_ref
+    metrics["ai_model"] = ai_model
     metrics["frequency_minutes"] = int(getattr(sub, "frequency_minutes", 60) or 60)
 
     sub_type = (getattr(sub, "subscription_type", None) or "events").lower()
@@ -319,40 +335,30 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
         if getattr(sub, "is_trial", False):
             trial_ends_at = getattr(sub, "trial_ends_at", None)
             if trial_ends_at and trial_ends_at <= now_utc:
-                st = (
-                    await db.execute(
-                        select(SubscriptionState).where(SubscriptionState.subscription_id == sub_id)
-                    )
-                ).scalar_one_or_none()
-
                 sub.is_active = False
                 sub.status = "trial_expired"
                 sub.last_error = None
 
                 if st is None:
-                    st = SubscriptionState(subscription_id=sub.id)
+                    st = SubscriptionState(subscription_id=sub_id)
                     db.add(st)
 
                 st.last_checked_at = now_utc
                 st.next_run_at = None
                 return
 
-        st = (
-            await db.execute(
-                select(SubscriptionState).where(SubscriptionState.subscription_id == sub_id)
-            )
-        ).scalar_one_or_none()
-
         last_message_id = getattr(st, "last_message_id", None) if st else None
         freq_min = metrics["frequency_minutes"]
+        # окно выборки и следующий запуск считаются от одного и того же шага
+        freq_td = timedelta(minutes=freq_min)
 
         owner_user_id = metrics["owner_user_id"]
         if not owner_user_id:
             # Misconfigured subscription — not a runtime failure. Park it.
-            print(f"[subscriptions_runner] SKIP sub_id={sub.id} reason=NO_OWNER_USER_ID")
+            log.warning("SKIP sub_id=%s reason=NO_OWNER_USER_ID", sub_id)
 
             if st is None:
-                st = SubscriptionState(subscription_id=sub.id)
+                st = SubscriptionState(subscription_id=sub_id)
                 db.add(st)
 
             st.last_checked_at = now_utc
@@ -361,10 +367,6 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
             return
 
         owner_user_id = int(owner_user_id)
-
-        owner = (
-            await db.execute(select(User).where(User.id == owner_user_id))
-        ).scalar_one_or_none()
         owner_language = getattr(owner, "language", None) or "en"
 
         source_mode = metrics["source_mode"]
@@ -373,7 +375,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
         # DIGEST / SUMMARY
         # =====================================================================
         if sub_type == "digest":
-            since_dt = now_utc - timedelta(minutes=freq_min)
+            since_dt = now_utc - freq_td
             min_id = None
 
             fetch_t0 = time.perf_counter()
@@ -382,7 +384,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                 if source_mode == "service":
                     entity, msgs = await fetch_service_chat_messages_for_subscription(
                         db=db,
-                        chat_link=sub.chat_ref,
+                        chat_link=chat_ref,
                         since_dt=since_dt,
                         min_id=min_id,
                         limit=EVENTS_READ_LIMIT,
@@ -391,7 +393,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                     entity, msgs = await fetch_chat_messages_for_subscription(
                         db=db,
                         owner_user_id=owner_user_id,
-                        chat_link=sub.chat_ref,
+                        chat_link=chat_ref,
                         since_dt=since_dt,
                         min_id=min_id,
                         limit=EVENTS_READ_LIMIT,
@@ -406,7 +408,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                     sub.chat_id = int(ent_id)
 
             if st is None:
-                st = SubscriptionState(subscription_id=sub.id)
+                st = SubscriptionState(subscription_id=sub_id)
                 db.add(st)
 
             metrics["messages_fetched_count"] = len(msgs or [])
@@ -415,7 +417,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                 # No messages → no LLM call → no UsageEvent (per TZ MVP).
                 st.last_success_at = now_utc
                 st.last_checked_at = now_utc
-                st.next_run_at = now_utc + timedelta(minutes=freq_min)
+                st.next_run_at = now_utc + freq_td
                 return
 
             metrics["messages_sent_to_llm_count"] = len(msgs)
@@ -439,7 +441,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                     chat_title=chat_title,
                     messages=msgs,
                     answer_language=owner_language,
-                    ai_model=sub.ai_model,
+                    ai_model=ai_model,
                     return_usage=True,
                 )
                 metrics["phase"] = "post_llm"
@@ -465,7 +467,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
             stmt = (
                 insert(DigestEvent)
                 .values(
-                    subscription_id=sub.id,
+                    subscription_id=sub_id,
                     window_start=since_dt,
                     window_end=now_utc,
                     start_message_id=int(oldest_id) if oldest_id else None,
@@ -484,7 +486,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                 st.last_message_id = int(newest_id)
             st.last_success_at = now_utc
             st.last_checked_at = now_utc
-            st.next_run_at = now_utc + timedelta(minutes=freq_min)
+            st.next_run_at = now_utc + freq_td
 
             await _record_subscription_run_success_same_session(db, metrics)
             return
@@ -493,10 +495,11 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
         # EVENTS
         # =====================================================================
         if last_message_id:
-            since_dt = datetime(1970, 1, 1, tzinfo=timezone.utc)
+            # cursor-режим: граница только по id, без фильтра по времени
+            since_dt = None
             min_id = int(last_message_id)
         else:
-            since_dt = now_utc - timedelta(minutes=freq_min)
+            since_dt = now_utc - freq_td
             min_id = None
 
         fetch_t0 = time.perf_counter()
@@ -505,7 +508,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
             if source_mode == "service":
                 entity, msgs = await fetch_service_chat_messages_for_subscription(
                     db=db,
-                    chat_link=sub.chat_ref,
+                    chat_link=chat_ref,
                     since_dt=since_dt,
                     min_id=min_id,
                     limit=EVENTS_READ_LIMIT,
@@ -514,7 +517,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                 entity, msgs = await fetch_chat_messages_for_subscription(
                     db=db,
                     owner_user_id=owner_user_id,
-                    chat_link=sub.chat_ref,
+                    chat_link=chat_ref,
                     since_dt=since_dt,
                     min_id=min_id,
                     limit=EVENTS_READ_LIMIT,
@@ -529,16 +532,27 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                 sub.chat_id = int(ent_id)
 
         if st is None:
-            st = SubscriptionState(subscription_id=sub.id)
+            st = SubscriptionState(subscription_id=sub_id)
             db.add(st)
 
         metrics["messages_fetched_count"] = len(msgs or [])
 
+        if msgs and min_id is not None:
+            # страховка от устаревших сообщений (<= курсора) из фетчера:
+            # без них нечего слать в LLM — не платим за пустой вызов.
+            # фетчеры отдают int id; строки с битым id просто отбрасываем
+            msgs = [
+                m for m in msgs
+                if isinstance(m, dict)
+                and isinstance(m.get("message_id"), int)
+                and m["message_id"] > min_id
+            ]
+
         if not msgs:
             # No messages → no LLM → no UsageEvent (per TZ MVP).
             st.last_success_at = now_utc
             st.last_checked_at = now_utc
-            st.next_run_at = now_utc + timedelta(minutes=freq_min)
+            st.next_run_at = now_utc + freq_td
             return
 
         metrics["messages_sent_to_llm_count"] = len(msgs)
@@ -553,12 +567,8 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
             except Exception:
                 continue
 
-        ids = [
-            int(m["message_id"])
-            for m in msgs
-            if isinstance(m, dict) and m.get("message_id") is not None
-        ]
-        newest_id = max(ids) if ids else last_message_id
+        # id уже собраны в msg_by_id — без второго прохода и списка ids
+        newest_id = max(msg_by_id, default=last_message_id)
 
         llm_t0 = time.perf_counter()
         metrics["phase"] = "llm_calling"
@@ -568,7 +578,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
                 chat_title=getattr(entity, "title", None) or getattr(entity, "username", None) or "Chat",
                 messages=msgs,
                 ux_language=owner_language,
-                ai_model=sub.ai_model,
+                ai_model=ai_model,
                 return_usage=True,
             )
             metrics["phase"] = "post_llm"
@@ -587,7 +597,7 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
         # diagnostic than meaningful here, but we still log it for symmetry.
         answer_chars = 0
 
-        matches_written = 0
+        match_rows: list[dict] = []
         for item in matches:
             mid = item.get("message_id")
             if mid is None:
@@ -605,47 +615,42 @@ async def _process_one_subscription(db, sub_id: int, now_utc: datetime) -> None:
             if len(excerpt) > 300:
                 excerpt = excerpt[:300].rstrip() + "…"
 
-            ts = None
             try:
-                if src and src.get("message_ts"):
-                    ts = parse_iso_ts(src.get("message_ts"))
-                else:
-                    ts = parse_iso_ts(item.get("message_ts"))
+                ts = parse_iso_ts((src.get("message_ts") if src else None) or item.get("message_ts"))
             except Exception:
                 ts = None
 
             reason = item.get("reason")
             answer_chars += len(excerpt) + len(reason or "")
 
-            db.add(
-                MatchEvent(
-                    subscription_id=sub.id,
-                    message_id=int(mid),
-                    message_ts=ts,
-                    author_id=author_id,
-                    author_display=author_display,
-                    excerpt=excerpt,
-                    reason=reason,
-                    notify_status="queued",
-                    llm_payload=None,
-                )
-            )
-            matches_written += 1
-
-        metrics["matches_written"] = matches_written
+            match_rows.append({
+                "subscription_id": sub_id,
+                "message_id": int(mid),
+                "message_ts": ts,
+                "author_id": author_id,
+                "author_display": author_display,
+                "excerpt": excerpt,
+                "reason": reason,
+                "notify_status": "queued",
+                # llm_payload не передаём — SQL NULL, а не JSON 'null'
+            })
+
+        # один INSERT ... ON CONFLICT DO NOTHING вместо db.add на каждый матч
+        inserted = await bulk_insert_match_events(db, match_rows)
+        metrics["matches_written"] = len(inserted)
         metrics["answer_chars"] = answer_chars or None
 
         st.last_message_id = int(newest_id) if newest_id else st.last_message_id
         st.last_success_at = now_utc
         st.last_checked_at = now_utc
-        st.next_run_at = now_utc + timedelta(minutes=freq_min)
+        st.next_run_at = now_utc + freq_td
 
         await _record_subscription_run_success_same_session(db, metrics)
 
     except Exception as err:
         # Write subscription_run_failed in a SEPARATE session — main session
-        # is about to be rolled back by run_tick(). Then re-raise so the
-        # retry-scheduling logic in run_tick can fire.
+        # is about to be rolled back by _run_one_subscription(). Then re-raise so the
+        # retry-scheduling logic in _run_one_subscription can fire.
         await _record_subscription_run_failed_new_session(metrics, error=err)
         raise
 
@@ -670,69 +675,146 @@ def _approx_context_chars(msgs: list[dict]) -> int:
 # Runner
 # ---------------------------------------------------------------------------
 
+async def _run_one_subscription(sub_id: int, now_utc: datetime) -> int:
+    """
+    Одна подписка в своей сессии (AsyncSession нельзя делить между
+    параллельными задачами). commit/rollback только здесь, НЕ внутри
+    _process_one_subscription. Возвращает exit code (0 / 1); ретрай для
+    упавших ставит run_tick одним UPDATE (_schedule_retries).
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            await _process_one_subscription(db, sub_id, now_utc)
+            await db.commit()
+            log.info("OK sub_id=%s", sub_id)
+            return 0
+
+        except Exception as e:
+            log.warning("FAILED sub_id=%s err=%s", sub_id, e)
+
+            # сбрасываем транзакцию
+            try:
+                await db.rollback()
+            except Exception as rb_e:
+                log.error("ROLLBACK_FAILED sub_id=%s err=%s", sub_id, rb_e)
+    return 1
+
+
+async def _schedule_retries(sub_ids: list[int], now_utc: datetime) -> None:
+    """
+    Ретрай упавших за тик подписок — одна сессия и один UPDATE на всех,
+    а не сессия + SELECT + UPDATE на каждую (при сбое TG/LLM падают пачкой).
+    """
+    if not sub_ids:
+        return
+    try:
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                await db.execute(
+                    update(SubscriptionState)
+                    .where(SubscriptionState.subscription_id.in_(sub_ids))
+                    .values(next_run_at=now_utc + timedelta(minutes=RETRY_MINUTES))
+                    .execution_options(synchronize_session=False)
+                )
+    except Exception as e:
+        log.error("FAILED to schedule retry sub_ids=%s err=%s", sub_ids, e)
+
+
 async def run_tick() -> int:
+    """
+    Один тик. Telethon-клиент здесь НЕ отключаем: в --loop режиме он
+    переживает тики (без reconnect + auth на каждом), отключение — в
+    _run_once / run_loop.
+    """
     now_utc = datetime.now(timezone.utc)
-    exit_code = 0
 
+    # 1) Reserve (короткая сессия)
+    async with AsyncSessionLocal() as db:
+        try:
+            due = await _reserve_due_subscriptions(db, now_utc)
+        except SQLAlchemyError as e:
+            log.error("RESERVE_FAILED: %s", e)
+            return 2
+
+    if not due:
+        log.info("No due subscriptions")
+        return 0
+
+    # 2) Подписки параллельно (до SUB_CONCURRENCY), но подписки одного
+    # владельца — по очереди: у него один Telethon-клиент (tg_clients)
+    # и общие лимиты Telegram на аккаунт.
+    sem = asyncio.Semaphore(SUB_CONCURRENCY)
+    owner_locks: dict[Optional[int], asyncio.Lock] = {}
+
+    async def _bounded(sub_id: int, owner_user_id: Optional[int]) -> int:
+        async with owner_locks.setdefault(owner_user_id, asyncio.Lock()):
+            async with sem:
+                return await _run_one_subscription(sub_id, now_utc)
+
+    codes = await asyncio.gather(*(_bounded(sid, owner) for sid, owner in due))
+    await _schedule_retries(
+        [sid for (sid, _), code in zip(due, codes) if code], now_utc
+    )
+    return max(codes, default=0)
+
+
+async def _disconnect_tg() -> None:
     try:
-        # 1) Reserve (короткая сессия)
-        async with AsyncSessionLocal() as db:
-            try:
-                due_ids = await _reserve_due_subscriptions(db, now_utc)
-            except SQLAlchemyError as e:
-                print(f"[subscriptions_runner] RESERVE_FAILED: {e}")
-                return 2
+        await disconnect_tg_client()
+    except Exception as e:
+        log.warning("disconnect_tg_client FAILED: %s", e)
 
-        if not due_ids:
-            print("[subscriptions_runner] No due subscriptions")
-            return 0
 
-        # 2) Process each subscription in one shared db session,
-        # commit/rollback only here (НЕ внутри _process_one_subscription)
-        async with AsyncSessionLocal() as db:
-            for sub_id in due_ids:
-                try:
-                    await _process_one_subscription(db, sub_id, now_utc)
-                    await db.commit()
-                    print(f"[subscriptions_runner] OK sub_id={sub_id}")
-
-                except Exception as e:
-                    print(f"[subscriptions_runner] FAILED sub_id={sub_id} err={e}")
-                    exit_code = 1
-
-                    # сбрасываем транзакцию
-                    try:
-                        await db.rollback()
-                    except Exception as rb_e:
-                        print(f"[subscriptions_runner] ROLLBACK_FAILED sub_id={sub_id} err={rb_e}")
-
-                    # ретрай — в отдельной сессии
-                    try:
-                        async with AsyncSessionLocal() as db2:
-                            async with db2.begin():
-                                st = (
-                                    await db2.execute(
-                                        select(SubscriptionState).where(
-                                            SubscriptionState.subscription_id == sub_id
-                                        )
-                                    )
-                                ).scalar_one_or_none()
-                                if st:
-                                    st.next_run_at = now_utc + timedelta(minutes=RETRY_MINUTES)
-                    except Exception as e2:
-                        print(f"[subscriptions_runner] FAILED to schedule retry sub_id={sub_id} err={e2}")
-
-        return exit_code
+async def run_loop() -> None:
+    """
+    Долгоживущий воркер вместо cron-процесса на каждый тик: Telethon-
+    соединение и пул БД переживают тики, отключаемся только при выходе.
+    """
+    interval = int(os.getenv("SUBSCRIPTIONS_TICK_INTERVAL_SEC", "60"))
+    try:
+        while True:
+            try:
+                await run_tick()
+            except Exception:  # noqa: BLE001
+                log.exception("TICK_CRASHED")
+            await asyncio.sleep(interval)
+    finally:
+        await _disconnect_tg()
+
 
+async def _run_once() -> int:
+    """Один тик (cron): Telethon отключаем до выхода из event loop."""
+    try:
+        return await run_tick()
     finally:
-        try:
-            await disconnect_tg_client()
-        except Exception as e:
-            print(f"[subscriptions_runner] disconnect_tg_client FAILED: {e}")
+        await _disconnect_tg()
+
+
+def _setup_logging() -> QueueListener:
+    """
+    Логи пишет фоновый поток: параллельные задачи подписок только кладут
+    запись в очередь и не упираются в stdout/pipe.
+    """
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("[%(name)s] %(levelname)s %(message)s"))
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(q)])
+    listener = QueueListener(q, stream)
+    listener.start()
+    return listener
 
 
 def main():
-    code = asyncio.run(run_tick())
+    listener = _setup_logging()
+    try:
+        # `python -m jobs.subscriptions_runner --loop` — воркер; без флага — один тик (cron)
+        if "--loop" in sys.argv[1:]:
+            asyncio.run(run_loop())
+            return
+        code = asyncio.run(_run_once())
+    finally:
+        # дописать хвост очереди до выхода процесса
+        listener.stop()
     raise SystemExit(code)
 
 
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+from functools import lru_cache
 from typing import Any, Optional, Union
 
 from .models import resolve_model_config, DEFAULT_AI_MODEL
@@ -47,6 +48,23 @@ def _lang_name(value: Any) -> str:
 # Low-level helpers
 # ---------------------------------------------------------------------------
 
+def _reply_tag(reply_to: Any) -> str:
+    return f" reply_to={int(reply_to)}" if reply_to else ""
+
+
+# Per-message cap inside subscription prompts: a single huge forwarded
+# post should not eat the context window (and token bill) of the whole
+# batch. Still far more than the classifier's 300-char excerpt needs.
+_SUB_MESSAGE_CHAR_LIMIT = 2000
+
+
+def _clip_message_text(text: Any) -> str:
+    text = text or ""
+    if len(text) <= _SUB_MESSAGE_CHAR_LIMIT:
+        return text
+    return text[:_SUB_MESSAGE_CHAR_LIMIT].rstrip() + "…"
+
+
 def _safe_parse_json(raw: str) -> dict:
     try:
         return json.loads(raw)
@@ -132,49 +150,12 @@ _EMPTY_CHAT_MESSAGES: dict[str, str] = {
 }
 
 
-async def summarize_chat_messages(
-    *,
-    user_query: str,
-    chat_name: str,
-    text_messages: list[dict],
-    fallback_language: str = "en",
-    ai_model: str = DEFAULT_AI_MODEL,
-    return_usage: bool = False,
-) -> Union[str, LlmTextResult]:
-    """
-    Answer a user's question grounded in a Telegram chat fragment.
-
-    LLM-native language detection: the model responds in the same
-    language as `user_query`. `fallback_language` (expected to be
-    `user.language`) is used only when the question's language is
-    ambiguous (too short, emoji-only, mixed).
-
-    Return contract:
-      - default (`return_usage=False`): returns the plain text str —
-        backward-compatible with the original signature.
-      - `return_usage=True`: returns an `LlmTextResult` with .text,
-        .usage (input/output/total tokens + tokens_source), .ai_model,
-        .provider, .provider_model. Use this in code paths that need
-        to write a UsageEvent.
-    """
-    lines = []
-    for msg in text_messages:
-        date = msg.get("date") or ""
-        sender = msg.get("from") or "Unknown"
-        text = msg.get("text") or ""
-        lines.append(f"[{date}] {sender}: {text}")
-
-    context = "\n".join(lines)
-
-    if not context:
-        empty_text = _EMPTY_CHAT_MESSAGES[_normalize_lang_code(fallback_language)]
-        if return_usage:
-            return _empty_text_result(ai_model=ai_model, text=empty_text)
-        return empty_text
-
-    fallback_lang_name = _lang_name(fallback_language)
-
-    system_prompt = (
+# System prompts depend only on the language name (a handful of values),
+# so each variant is built once and reused byte-for-byte. A stable system
+# message is the prefix provider-side prompt caching keys on.
+@lru_cache(maxsize=None)
+def _qa_system_prompt(fallback_lang_name: str) -> str:
+    return (
         "You are CoTel, an expert analyst of Telegram chat conversations. "
         "Users come to you to find specific information, patterns, or "
         "insights in their chat history that would be tedious to find "
@@ -217,6 +198,47 @@ async def summarize_chat_messages(
         "wrapper."
     )
 
+
+async def summarize_chat_messages(
+    *,
+    user_query: str,
+    chat_name: str,
+    text_messages: list[dict],
+    fallback_language: str = "en",
+    ai_model: str = DEFAULT_AI_MODEL,
+    return_usage: bool = False,
+) -> Union[str, LlmTextResult]:
+    """
+    Answer a user's question grounded in a Telegram chat fragment.
+
+    LLM-native language detection: the model responds in the same
+    language as `user_query`. `fallback_language` (expected to be
+    `user.language`) is used only when the question's language is
+    ambiguous (too short, emoji-only, mixed).
+
+    Return contract:
+      - default (`return_usage=False`): returns the plain text str —
+        backward-compatible with the original signature.
+      - `return_usage=True`: returns an `LlmTextResult` with .text,
+        .usage (input/output/total tokens + tokens_source), .ai_model,
+        .provider, .provider_model. Use this in code paths that need
+        to write a UsageEvent.
+    """
+    context = "\n".join([
+        f"[{msg.get('date') or ''}] {msg.get('from') or 'Unknown'}: {msg.get('text') or ''}"
+        for msg in text_messages
+    ])
+
+    if not context:
+        empty_text = _EMPTY_CHAT_MESSAGES[_normalize_lang_code(fallback_language)]
+        if return_usage:
+            return _empty_text_result(ai_model=ai_model, text=empty_text)
+        return empty_text
+
+    fallback_lang_name = _lang_name(fallback_language)
+
+    system_prompt = _qa_system_prompt(fallback_lang_name)
+
     user_prompt = (
         f"Chat name: {chat_name}\n\n"
         f"Chat messages (oldest to newest):\n{context}\n\n"
@@ -247,53 +269,9 @@ _EMPTY_CLASSIFY_SUMMARY: dict[str, str] = {
 }
 
 
-async def classify_subscription_matches(
-    *,
-    prompt: str,
-    chat_title: str,
-    messages: list[dict],
-    ux_language: str = "en",
-    ai_model: str = DEFAULT_AI_MODEL,
-    return_usage: bool = False,
-) -> Union[dict, LlmJsonResult]:
-    """
-    Filter a batch of messages against an event-subscription query.
-
-    `ux_language` (expected to be `user.language`) controls the
-    language of the service fields (`reason`, `summary_reason`) which
-    are OUR UX copy shown in the dispatched Telegram digest.
-    `excerpt` is always a verbatim raw quote.
-
-    Return contract:
-      - default (`return_usage=False`): returns parsed JSON dict
-        (backward-compatible).
-      - `return_usage=True`: returns an `LlmJsonResult` with .data
-        (the same dict), .usage, .ai_model, .provider, .provider_model.
-    """
-    lines = []
-    for m in messages:
-        mid = m.get("message_id")
-        ts = m.get("message_ts")
-        a = m.get("author_display") or "Unknown"
-        aid = m.get("author_id")
-        txt = m.get("text") or ""
-        lines.append(f"[{mid}] [{ts}] {a} (author_id={aid}): {txt}")
-
-    context = "\n".join(lines)
-    if not context:
-        empty_data = {
-            "found": False,
-            "matches": [],
-            "summary_reason": _EMPTY_CLASSIFY_SUMMARY[_normalize_lang_code(ux_language)],
-            "confidence": 0.0,
-        }
-        if return_usage:
-            return _empty_json_result(ai_model=ai_model, data=empty_data)
-        return empty_data
-
-    ux_lang_name = _lang_name(ux_language)
-
-    system_prompt = (
+@lru_cache(maxsize=None)
+def _classify_system_prompt(ux_lang_name: str) -> str:
+    return (
         "You are a Telegram message classifier for CoTel event-based "
         "subscriptions.\n\n"
         "Goal: given a subscription query (what the user is watching "
@@ -318,9 +296,6 @@ async def classify_subscription_matches(
         "  \"matches\": [\n"
         "    {\n"
         "      \"message_id\": <int, copied from input [brackets]>,\n"
-        "      \"message_ts\": \"<ISO8601, copied from input>\",\n"
-        "      \"author_display\": \"<copied from input>\",\n"
-        "      \"author_id\": <int copied from input, or null if missing>,\n"
         "      \"excerpt\": \"<verbatim quote, ≤300 chars, original language>\",\n"
         f"      \"reason\": \"<one short sentence ≤140 chars in {ux_lang_name}>\"\n"
         "    }\n"
@@ -337,11 +312,58 @@ async def classify_subscription_matches(
         "- If nothing matches: found=false, matches=[]."
     )
 
+
+async def classify_subscription_matches(
+    *,
+    prompt: str,
+    chat_title: str,
+    messages: list[dict],
+    ux_language: str = "en",
+    ai_model: str = DEFAULT_AI_MODEL,
+    return_usage: bool = False,
+) -> Union[dict, LlmJsonResult]:
+    """
+    Filter a batch of messages against an event-subscription query.
+
+    `ux_language` (expected to be `user.language`) controls the
+    language of the service fields (`reason`, `summary_reason`) which
+    are OUR UX copy shown in the dispatched Telegram digest.
+    `excerpt` is always a verbatim raw quote.
+
+    Return contract:
+      - default (`return_usage=False`): returns parsed JSON dict
+        (backward-compatible).
+      - `return_usage=True`: returns an `LlmJsonResult` with .data
+        (the same dict), .usage, .ai_model, .provider, .provider_model.
+    """
+    # Callers take author/timestamp from the source message by message_id,
+    # so the model does not echo them back and author_id is not sent at
+    # all — fewer tokens on both the input and the output side.
+    context = "\n".join([
+        f"[{m.get('message_id')}] [{m.get('message_ts')}] "
+        f"{m.get('author_display') or 'Unknown'}: {_clip_message_text(m.get('text'))}"
+        for m in messages
+    ])
+    if not context:
+        empty_data = {
+            "found": False,
+            "matches": [],
+            "summary_reason": _EMPTY_CLASSIFY_SUMMARY[_normalize_lang_code(ux_language)],
+            "confidence": 0.0,
+        }
+        if return_usage:
+            return _empty_json_result(ai_model=ai_model, data=empty_data)
+        return empty_data
+
+    ux_lang_name = _lang_name(ux_language)
+
+    system_prompt = _classify_system_prompt(ux_lang_name)
+
     user_prompt = (
         f"Chat name: {chat_title}\n\n"
         f"Subscription query:\n{prompt}\n\n"
         "New messages (each line: [message_id] [message_ts] "
-        "author_display (author_id=NNN): text):\n"
+        "author_display: text):\n"
         f"{context}"
     )
 
@@ -372,49 +394,9 @@ async def classify_subscription_matches(
 # Summary-subscription digest builder
 # ---------------------------------------------------------------------------
 
-async def build_subscription_digest(
-    *,
-    prompt: str,
-    chat_title: str,
-    messages: list[dict],
-    answer_language: str = "en",
-    ai_model: str = DEFAULT_AI_MODEL,
-    return_usage: bool = False,
-) -> Union[dict, LlmJsonResult]:
-    """
-    Build a summary-style digest for a subscription window.
-
-    `answer_language` (expected to be `user.language`) controls the
-    narration language. Verbatim quotes inside the digest remain in
-    their source language per our i18n rules.
-
-    Return contract:
-      - default (`return_usage=False`): returns parsed JSON dict
-        (backward-compatible).
-      - `return_usage=True`: returns an `LlmJsonResult` with .data,
-        .usage, .ai_model, .provider, .provider_model.
-    """
-    lines = []
-    for m in messages:
-        mid = m.get("message_id")
-        ts = m.get("message_ts")
-        a = m.get("author_display") or "Unknown"
-        aid = m.get("author_id")
-        txt = m.get("text") or ""
-        r = m.get("reply_to")
-        reply_tag = f" reply_to={int(r)}" if r else ""
-        lines.append(f"[{mid}] [{ts}] {a} (author_id={aid}){reply_tag}: {txt}")
-
-    context = "\n".join(lines)
-    if not context:
-        empty_data = {"digest_text": "", "confidence": 0.0}
-        if return_usage:
-            return _empty_json_result(ai_model=ai_model, data=empty_data)
-        return empty_data
-
-    answer_lang_name = _lang_name(answer_language)
-
-    system_prompt = (
+@lru_cache(maxsize=None)
+def _digest_system_prompt(answer_lang_name: str) -> str:
+    return (
         "You are CoTel, an analyst of Telegram chat conversations.\n\n"
         "Task: given a slice of chat messages (some with reply_to=<id> "
         "indicating replies) and the user's description of what kind of "
@@ -452,6 +434,45 @@ async def build_subscription_digest(
         "}"
     )
 
+
+async def build_subscription_digest(
+    *,
+    prompt: str,
+    chat_title: str,
+    messages: list[dict],
+    answer_language: str = "en",
+    ai_model: str = DEFAULT_AI_MODEL,
+    return_usage: bool = False,
+) -> Union[dict, LlmJsonResult]:
+    """
+    Build a summary-style digest for a subscription window.
+
+    `answer_language` (expected to be `user.language`) controls the
+    narration language. Verbatim quotes inside the digest remain in
+    their source language per our i18n rules.
+
+    Return contract:
+      - default (`return_usage=False`): returns parsed JSON dict
+        (backward-compatible).
+      - `return_usage=True`: returns an `LlmJsonResult` with .data,
+        .usage, .ai_model, .provider, .provider_model.
+    """
+    context = "\n".join([
+        f"[{m.get('message_id')}] [{m.get('message_ts')}] "
+        f"{m.get('author_display') or 'Unknown'} (author_id={m.get('author_id')})"
+        f"{_reply_tag(m.get('reply_to'))}: {_clip_message_text(m.get('text'))}"
+        for m in messages
+    ])
+    if not context:
+        empty_data = {"digest_text": "", "confidence": 0.0}
+        if return_usage:
+            return _empty_json_result(ai_model=ai_model, data=empty_data)
+        return empty_data
+
+    answer_lang_name = _lang_name(answer_language)
+
+    system_prompt = _digest_system_prompt(answer_lang_name)
+
     user_prompt = (
         f"Chat name: {chat_title}\n\n"
         "Messages (each line: [message_id] [message_ts] author_display "
@@ -12,6 +12,7 @@ import hashlib
 import secrets
 
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 import time
 import sqlalchemy as sa
 import re
@@ -540,10 +541,14 @@ def extract_text_messages(messages, limit: int = 100000):
     Берём только текстовые сообщения (type == 'message'),
     аккуратно разворачиваем поле text (оно может быть строкой или списком),
     и возвращаем последние `limit` штук.
+    Идём с конца списка и останавливаемся на `limit` — не разбираем и не
+    копируем всю историю экспорта ради хвоста.
     """
     text_msgs = []
+    if limit <= 0:
+        return text_msgs
 
-    for m in messages:
+    for m in reversed(messages):
         if not isinstance(m, dict):
             continue
         if m.get("type") != "message":
@@ -573,9 +578,12 @@ def extract_text_messages(messages, limit: int = 100000):
             "from": m.get("from"),
             "text": text,
         })
+        if len(text_msgs) >= limit:
+            break
 
-    # берём только последние limit сообщений
-    return text_msgs[-limit:]
+    # собирали с конца — возвращаем в хронологическом порядке
+    text_msgs.reverse()
+    return text_msgs
 
 def parse_iso_ts(value):
     if value is None:
@@ -583,42 +591,57 @@ def parse_iso_ts(value):
     if isinstance(value, datetime):
         return value
     if isinstance(value, str):
-        s = value.strip()
-        # поддержка "Z"
-        if s.endswith("Z"):
-            s = s[:-1] + "+00:00"
-        try:
-            return datetime.fromisoformat(s)
-        except Exception:
-            return None
+        return _parse_iso_str(value)
     return None
 
-def build_tg_message_link(chat_ref: str | None, chat_id: int | None, message_id: int | None) -> str | None:
-    if not message_id:
+
+# message_ts в окне чата часто повторяются (секундная точность), а datetime
+# неизменяемый — результат разбора строки можно безопасно переиспользовать
+@lru_cache(maxsize=4096)
+def _parse_iso_str(value: str):
+    s = value.strip()
+    # поддержка "Z"
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(s)
+    except Exception:
         return None
 
+_TG_USERNAME_LINK_RE = re.compile(r"(?:https?://)?t\.me/([A-Za-z0-9_]{3,})")
+# peer id супергруппы/канала = -100<internal>; в t.me/c/ нужен только <internal>
+_TG_CHANNEL_ID_PREFIX = "100"
+
+
+def build_tg_chat_link_prefix(chat_ref: str | None, chat_id: int | None) -> str | None:
+    """
+    Префикс ссылки на сообщение чата ("https://t.me/<username>/" или
+    "https://t.me/c/<internal>/"), без message_id.
+    Зависит только от подписки — считаем один раз, а не на каждое событие.
+    """
     ref = (chat_ref or "").strip()
 
     # 1) username из @username
     if ref.startswith("@") and len(ref) > 1:
         uname = ref[1:]
-        return f"https://t.me/{uname}/{message_id}"
+        return f"https://t.me/{uname}/"
 
     # 2) username из t.me/username или https://t.me/username
-    m = re.search(r"(?:https?://)?t\.me/([A-Za-z0-9_]{3,})", ref)
+    # (regex только если подстрока вообще есть — обычно это @username или пусто)
+    m = _TG_USERNAME_LINK_RE.search(ref) if "t.me/" in ref else None
     if m:
         uname = m.group(1)
         # если это invite-ссылка вида t.me/+HASH — не подойдет
         if not uname.startswith("+"):
-            return f"https://t.me/{uname}/{message_id}"
+            return f"https://t.me/{uname}/"
 
     # 3) приватный супергрупповой линк через /c/
     if chat_id:
         aid = abs(int(chat_id))
         s = str(aid)
-        if s.startswith("100") and len(s) > 3:
-            internal = s[3:]
-            return f"https://t.me/c/{internal}/{message_id}"
+        if s.startswith(_TG_CHANNEL_ID_PREFIX) and len(s) > len(_TG_CHANNEL_ID_PREFIX):
+            internal = s[len(_TG_CHANNEL_ID_PREFIX):]
+            return f"https://t.me/c/{internal}/"
 
     return None
 
@@ -654,6 +677,32 @@ async def tg_bot_link_start(
         "deeplink": deeplink,
     }
 
+
+_MATCH_INSERT_CHUNK = 500
+
+
+async def bulk_insert_match_events(db: AsyncSession, rows: list[dict]) -> list[int]:
+    """
+    Один INSERT ... VALUES (...), (...) ON CONFLICT DO NOTHING на все матчи
+    (вместо N отдельных insert/db.add). Дубли по uq_match_subscription_message
+    молча пропускаются.
+    rows — dict'ы с колонками MatchEvent.
+    Возвращает message_id реально вставленных строк.
+    """
+    inserted: list[int] = []
+    # режем по _MATCH_INSERT_CHUNK строк: у asyncpg потолок 32767 bind-параметров
+    # на запрос, а у MatchEvent ~9 колонок на строку
+    for i in range(0, len(rows), _MATCH_INSERT_CHUNK):
+        stmt = (
+            insert(MatchEvent)
+            .values(rows[i:i + _MATCH_INSERT_CHUNK])
+            .on_conflict_do_nothing(constraint="uq_match_subscription_message")
+            .returning(MatchEvent.message_id)
+        )
+        res = await db.execute(stmt)
+        inserted.extend(int(x) for x in res.scalars().all())
+    return inserted
+
 def _serialize_match_event(ev) -> dict:
     # ev = MatchEvent ORM object
     return {
@@ -685,8 +734,13 @@ async def run_subscriptions(
     # 1) Берём активные подписки ТОЛЬКО этого пользователя
     now_utc = datetime.now(timezone.utc)
 
+    # подписки вместе со state — одним запросом (outer join), а не SELECT
+    # state на каждую в цикле; сессия с expire_on_commit=False — объекты
+    # переживают commit'ы ниже
     res = await db.execute(
-        select(Subscription).where(
+        select(Subscription, SubscriptionState)
+        .outerjoin(SubscriptionState, SubscriptionState.subscription_id == Subscription.id)
+        .where(
             Subscription.is_active == True,
             Subscription.owner_user_id == owner_user_id,
             sa.or_(
@@ -696,7 +750,9 @@ async def run_subscriptions(
             ),
         )
     )
-    subs = list(res.scalars().all())
+    rows = res.all()
+    subs = [sub for sub, _ in rows]
+    states_by_sub: dict[int, SubscriptionState | None] = {sub.id: st for sub, st in rows}
 
     results = []
     total_checked = 0
@@ -727,16 +783,13 @@ async def run_subscriptions(
         }
 
         try:
-            st_res = await db.execute(
-                select(SubscriptionState).where(SubscriptionState.subscription_id == sub.id)
-            )
-            st = st_res.scalar_one_or_none()
+            st = states_by_sub.get(sub.id)
             last_message_id = getattr(st, "last_message_id", None) if st else None
 
             freq_min = int(getattr(sub, "frequency_minutes", 60) or 60)
 
             if last_message_id:
-                since_dt = datetime(1970, 1, 1, tzinfo=timezone.utc)
+                since_dt = None
                 min_id = int(last_message_id)
             else:
                 since_dt = now - timedelta(minutes=freq_min)
@@ -786,11 +839,14 @@ async def run_subscriptions(
             total_checked += checked
 
             # 5) newest_id
-            ids = []
-            for m in msgs:
-                if isinstance(m, dict) and m.get("message_id") is not None:
-                    ids.append(int(m["message_id"]))
-            newest_id = max(ids) if ids else last_message_id
+            newest_id = max(
+                (
+                    int(m["message_id"])
+                    for m in msgs
+                    if isinstance(m, dict) and m.get("message_id") is not None
+                ),
+                default=last_message_id,
+            )
 
             matches_written = 0
             inserted_message_ids: list[int] = []
@@ -821,6 +877,7 @@ async def run_subscriptions(
                     matches = llm_json.get("matches") or []
 
                     if found and isinstance(matches, list):
+                        match_rows: list[dict] = []
                         for m in matches:
                             mid = m.get("message_id")
                             if not mid:
@@ -854,32 +911,22 @@ async def run_subscriptions(
                             if len(excerpt) > 300:
                                 excerpt = excerpt[:300].rstrip() + "…"
 
-                            stmt = (
-                                insert(MatchEvent)
-                                .values(
-                                    subscription_id=sub.id,
-                                    message_id=int(mid),
-                                    message_ts=ts,
-                                    author_id=author_id,
-                                    author_display=author_display,
-                                    excerpt=excerpt,
-                                    reason=m.get("reason"),
-                                    llm_payload={},  # ты убрала payload — оставляем так
-                                    notify_status="queued",
-                                )
-                                .on_conflict_do_nothing(constraint="uq_match_subscription_message")
-                            )
-
-                            try:
-                                r = await db.execute(stmt)
-                                if getattr(r, "rowcount", 0) == 1:
-                                    matches_written += 1
-                                    inserted_message_ids.append(int(mid))
-
-                            except Exception as e:
-                                # не валим всю подписку из-за одного матча
-                                print("MATCH_INSERT_FAILED", sub.id, mid, str(e))
-                                continue
+                            match_rows.append({
+                                "subscription_id": sub.id,
+                                "message_id": int(mid),
+                                "message_ts": ts,
+                                "author_id": author_id,
+                                "author_display": author_display,
+                                "excerpt": excerpt,
+                                "reason": m.get("reason"),
+                                # llm_payload не передаём: колонка остаётся SQL NULL. Python None
+                                # JSON-тип биндит как JSON 'null' (через json.dumps)
+                                "notify_status": "queued",
+                            })
+
+                        # один INSERT на все матчи подписки
+                        inserted_message_ids = await bulk_insert_match_events(db, match_rows)
+                        matches_written = len(inserted_message_ids)
 
                 elif sub_type == "digest":
                     # заглушка на сейчас
@@ -1019,6 +1066,8 @@ async def analyze_chat(
                 "message": "Файл не является корректным JSON.",
             },
         )
+    # сырые байты больше не нужны — не держим вторую копию экспорта
+    del raw_bytes
 
     # 4. Проверка структуры Telegram экспорта (опционально)
     messages = data.get("messages")
@@ -1061,6 +1110,9 @@ async def analyze_chat(
 
     # 5. подготавливаем текстовые сообщения для LLM
     text_messages = extract_text_messages(messages, limit=400)
+    # дальше нужны только последние 400 сообщений: разобранный экспорт
+    # отпускаем до долгого await LLM, а не держим до конца запроса
+    del data, messages
 
     summary = None
     # Пока у нас один режим — произвольный запрос → summary
@@ -1493,17 +1545,145 @@ async def tg_qr_status(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"TG_QR_STATUS_FAILED: {str(e)}")
 
+# ---- BotUserLink: TTL-кэш "куда слать" ----------------------------------
+# Линк меняется редко (только /start в webhook), а читается на каждый тик
+# раннера и каждый dispatch. Кэшируем только найденные chat_id: свежая
+# привязка должна подхватываться сразу. Кэш per-process — webhook
+# сбрасывает его только у себя, в остальных процессах хватает TTL.
+_BOT_LINK_CACHE_TTL_SECONDS = 60.0
+
+_bot_link_cache: dict[int, tuple[int, float]] = {}
+
+
+def invalidate_bot_link_cache(owner_user_id: int | None = None) -> None:
+    """Сбросить кэш для одного владельца (или целиком)."""
+    if owner_user_id is None:
+        _bot_link_cache.clear()
+    else:
+        _bot_link_cache.pop(int(owner_user_id), None)
+
+
+async def get_bot_dest_chat_id(db: AsyncSession, owner_user_id: int) -> int | None:
+    """
+    Берём последний активный BotUserLink для owner_user_id (с TTL-кэшем).
+    """
+    owner_user_id = int(owner_user_id)
+    return (await get_bot_dest_chat_ids(db, (owner_user_id,))).get(owner_user_id)
+
+
+async def get_bot_dest_chat_ids(db: AsyncSession, owner_user_ids) -> dict[int, int]:
+    """
+    То же, что get_bot_dest_chat_id, но для пачки владельцев: промахи кэша
+    добираем одним DISTINCT ON-запросом вместо запроса на каждого.
+    Владельцы без активного линка в результат не попадают.
+    """
+    now = time.monotonic()
+    result: dict[int, int] = {}
+    missing: set[int] = set()
+    for owner_user_id in {int(x) for x in owner_user_ids}:
+        cached = _bot_link_cache.get(owner_user_id)
+        if cached is not None and now - cached[1] < _BOT_LINK_CACHE_TTL_SECONDS:
+            result[owner_user_id] = cached[0]
+        else:
+            missing.add(owner_user_id)
+
+    if missing:
+        res = await db.execute(
+            select(BotUserLink.owner_user_id, BotUserLink.telegram_chat_id)
+            .where(
+                BotUserLink.owner_user_id.in_(missing),
+                BotUserLink.is_blocked == False,  # noqa: E712
+            )
+            .distinct(BotUserLink.owner_user_id)
+            .order_by(BotUserLink.owner_user_id, BotUserLink.id.desc())
+        )
+        for owner_user_id, chat_id in res.all():
+            owner_user_id = int(owner_user_id)
+            result[owner_user_id] = int(chat_id)
+            _bot_link_cache[owner_user_id] = (int(chat_id), now)
+            missing.discard(owner_user_id)
+        for owner_user_id in missing:
+            _bot_link_cache.pop(owner_user_id, None)
+    return result
+
+
+class BotRetryAfter(RuntimeError):
+    """Bot API ответил 429 (flood control): повторить не раньше retry_after секунд."""
+
+    def __init__(self, retry_after: int, message: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Один keep-alive клиент на процесс: раньше каждый sendMessage открывал
+# новое TCP+TLS соединение к api.telegram.org.
+_bot_http_client: httpx.AsyncClient | None = None
+
+_BOT_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _get_bot_http_client() -> httpx.AsyncClient:
+    global _bot_http_client
+    if _bot_http_client is None or _bot_http_client.is_closed:
+        _bot_http_client = httpx.AsyncClient(
+            timeout=20.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        )
+    return _bot_http_client
+
+
+async def close_bot_http_client() -> None:
+    """Закрыть общий клиент Bot API (shutdown приложения / конец работы раннера)."""
+    global _bot_http_client
+    if _bot_http_client is not None:
+        await _bot_http_client.aclose()
+        _bot_http_client = None
+
+
+@app.on_event("shutdown")
+async def _close_bot_http_client_on_shutdown():
+    await close_bot_http_client()
+
+
+_BOT_DEFAULT_RETRY_AFTER_SEC = 1
+
+
+def _bot_retry_after_seconds(resp: httpx.Response) -> int:
+    """
+    retry_after из 429: parameters.retry_after в JSON-теле Bot API, иначе
+    заголовок Retry-After, иначе дефолт. Тело может быть не JSON или не dict
+    (429 от прокси) — это не должно ронять отправку.
+    """
+    try:
+        body = resp.json()
+    except ValueError:
+        body = None
+    params = body.get("parameters") if isinstance(body, dict) else None
+    value = params.get("retry_after") if isinstance(params, dict) else None
+    if value is None:
+        value = resp.headers.get("Retry-After")
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return _BOT_DEFAULT_RETRY_AFTER_SEC
+
+
 async def bot_send_message(chat_id: int, text: str):
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN_MISSING")
 
     url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, json={
-            "chat_id": chat_id,
-            "text": text,
-            "disable_web_page_preview": True,
-        })
+    # тело сериализуем сами: ensure_ascii=False отдаёт кириллицу UTF-8
+    # (2 байта на символ вместо 6 у \uXXXX), без пробелов в разделителях
+    body = json.dumps(
+        {"chat_id": chat_id, "text": text, "disable_web_page_preview": True},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    resp = await _get_bot_http_client().post(url, content=body, headers=_BOT_JSON_HEADERS)
+
+    if resp.status_code == 429:
+        raise BotRetryAfter(_bot_retry_after_seconds(resp), f"BOT_SEND_FAILED_HTTP_429: {resp.text}")
 
     if resp.status_code != 200:
         raise RuntimeError(f"BOT_SEND_FAILED_HTTP_{resp.status_code}: {resp.text}")
@@ -1593,6 +1773,7 @@ async def tg_bot_webhook(
 
     await db.execute(stmt)
     await db.commit()
+    invalidate_bot_link_cache(owner_user_id)
 
     await bot_send_message(
         telegram_chat_id,
@@ -2075,6 +2256,10 @@ async def switch_subscription_mode(
     return sub
 
 
+# лимит Telegram 4096 минус запас под хвост "…и ещё N совпадений."
+_DISPATCH_TEXT_LIMIT = 4096 - 64
+
+
 @app.post("/tg/bot/dispatch")
 async def tg_bot_dispatch(
     user: User = Depends(auth_get_current_user),
@@ -2083,23 +2268,26 @@ async def tg_bot_dispatch(
     t0 = time.perf_counter()
 
     # 1) куда слать — только для текущего пользователя
-    r = await db.execute(
-        select(BotUserLink)
-        .where(
-            BotUserLink.owner_user_id == user.id,
-            BotUserLink.is_blocked == False
-        )
-        .order_by(BotUserLink.id.desc())
-    )
-    link = r.scalars().first()
-    if not link:
+    dest_chat_id = await get_bot_dest_chat_id(db, user.id)
+    if not dest_chat_id:
         return {"status": "error", "error": "NO_BOT_USER_LINK"}
 
-    dest_chat_id = link.telegram_chat_id
-
     # 2) queued события — только подписки текущего пользователя
-    r2 = await db.execute(
-        select(MatchEvent, Subscription)
+    # стримим чанками (yield_per), группируя на лету — без промежуточного list(all())
+    # только колонки, нужные для текста: Core-строки вместо ORM MatchEvent/Subscription
+    r2 = await db.stream(
+        select(
+            MatchEvent.id,
+            MatchEvent.subscription_id,
+            MatchEvent.message_id,
+            MatchEvent.message_ts,
+            MatchEvent.author_id,
+            MatchEvent.author_display,
+            MatchEvent.excerpt,
+            Subscription.name,
+            Subscription.chat_ref,
+            Subscription.chat_id,
+        )
         .join(Subscription, Subscription.id == MatchEvent.subscription_id)
         .where(
             MatchEvent.notify_status == "queued",
@@ -2107,11 +2295,20 @@ async def tg_bot_dispatch(
         )
         .order_by(MatchEvent.subscription_id.asc(), MatchEvent.id.asc())
         .limit(200)
+        .execution_options(yield_per=50)
     )
 
-    rows = list(r2.all())
+    grouped = {}
+    events_total = 0
+    async for ev in r2:
+        events_total += 1
+        sid = int(ev.subscription_id)
+        if sid not in grouped:
+            # name/chat_ref/chat_id подписки едут в каждой строке — берём из первой
+            grouped[sid] = {"sub": ev, "events": []}
+        grouped[sid]["events"].append(ev)
 
-    if not rows:
+    if not events_total:
         elapsed = round(time.perf_counter() - t0, 2)
         return {
             "status": "ok",
@@ -2121,16 +2318,11 @@ async def tg_bot_dispatch(
             "elapsed_seconds": elapsed
         }
 
-    grouped = {}
-    for ev, sub in rows:
-        sid = int(ev.subscription_id)
-        if sid not in grouped:
-            grouped[sid] = {"sub": sub, "events": []}
-        grouped[sid]["events"].append(ev)
-
     sent_groups = 0
     failed_groups = 0
-    events_total = len(rows)
+    # статусы копим и пишем двумя UPDATE в конце, а не UPDATE на каждое событие
+    sent_ids: list[int] = []
+    failed_ids: list[int] = []
 
     for sid, pack in grouped.items():
         sub = pack["sub"]
@@ -2146,8 +2338,16 @@ async def tg_bot_dispatch(
                 f"Совпадений: {len(events)}\n"
             )
 
-            lines = []
-            for i, ev in enumerate(shown, start=1):
+            link_prefix = build_tg_chat_link_prefix(
+                getattr(sub, "chat_ref", None),
+                getattr(sub, "chat_id", None),
+            )
+
+            # собираем с учётом лимита Telegram: 10 событий с длинными excerpt
+            # не влезают в 4096 — не поместившиеся уходят в счётчик "ещё N"
+            text_parts = [header]
+            used = len(header)
+            for i, ev in enumerate(shown):
                 author = ev.author_display or (str(ev.author_id) if ev.author_id else "—")
                 ts = ev.message_ts.isoformat() if ev.message_ts else "—"
 
@@ -2155,40 +2355,39 @@ async def tg_bot_dispatch(
                 if len(excerpt) > 300:
                     excerpt = excerpt[:300].rstrip() + "…"
 
-                url = build_tg_message_link(
-                    chat_ref=getattr(sub, "chat_ref", None),
-                    chat_id=getattr(sub, "chat_id", None),
-                    message_id=int(ev.message_id),
-                )
-                link_text = f"\n{url}" if url else ""
+                line = f"\n{i + 1}) {author} • {ts}\n{excerpt or '—'}"
+                if link_prefix and ev.message_id:
+                    line = f"{line}\n{link_prefix}{int(ev.message_id)}"
 
-                lines.append(
-                    f"\n{i}) {author} • {ts}\n"
-                    f"{excerpt or '—'}"
-                    f"{link_text}"
-                )
+                if used + len(line) > _DISPATCH_TEXT_LIMIT:
+                    rest += len(shown) - i
+                    break
+                text_parts.append(line)
+                used += len(line)
 
+            # один join по всем кускам — без промежуточной конкатенации header + body
             if rest > 0:
-                lines.append(f"\n\n…и ещё {rest} совпадений.")
-
-            text = header + "".join(lines)
+                text_parts.append(f"\n\n…и ещё {rest} совпадений.")
+            text = "".join(text_parts)
 
             await bot_send_message(dest_chat_id, text)
 
-            for ev in events:
-                ev.notify_status = "sent"
-                db.add(ev)
-
+            sent_ids.extend(int(ev.id) for ev in events)
             sent_groups += 1
 
         except Exception as e:
-            for ev in events:
-                ev.notify_status = "failed"
-                db.add(ev)
-
+            failed_ids.extend(int(ev.id) for ev in events)
             failed_groups += 1
             print("DISPATCH_GROUP_FAILED", sid, str(e))
 
+    for ids, status in ((sent_ids, "sent"), (failed_ids, "failed")):
+        if ids:
+            await db.execute(
+                update(MatchEvent)
+                .where(MatchEvent.id.in_(ids))
+                .values(notify_status=status)
+                .execution_options(synchronize_session=False)
+            )
     await db.commit()
 
     elapsed = round(time.perf_counter() - t0, 2)
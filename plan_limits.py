@@ -209,10 +209,9 @@ async def expire_trial_subscription_if_needed(
     if not owner_user_id:
         return False
 
-    user_res = await db.execute(
-        select(User).where(User.id == owner_user_id)
-    )
-    owner_user = user_res.scalar_one_or_none()
+    # get() сначала смотрит identity map: в эндпоинтах владелец уже загружен
+    # авторизацией в этой же сессии — без SELECT на каждую trial-подписку
+    owner_user = await db.get(User, owner_user_id)
     if not owner_user:
         return False
 
@@ -734,6 +734,11 @@ async def invalidate_service_client(service_account_id: int) -> None:
             pass
 
 
+async def disconnect_service_clients() -> None:
+    for service_account_id in list(_service_clients):
+        await invalidate_service_client(service_account_id)
+
+
 # =========================
 # Telegram fetch
 # =========================
@@ -974,12 +979,15 @@ async def fetch_service_chat_messages_for_subscription(
     db: AsyncSession,
     *,
     chat_link: str,
-    since_dt: datetime,
+    since_dt: datetime | None,
     min_id: int | None = None,
     limit: int = 1000,
 ) -> tuple[object, list[dict]]:
     """
     Service-mode аналог fetch_chat_messages_for_subscription(...).
+    min_id отдаём в iter_messages: Telegram сам останавливается на курсоре,
+    а не отдаёт до limit сообщений, которые мы потом отбрасываем.
+    since_dt=None — без фильтра по времени (cursor-режим).
     Возвращает entity + сообщения в формате:
     {
       message_id,
@@ -1007,23 +1015,20 @@ async def fetch_service_chat_messages_for_subscription(
         entity = await ensure_join_and_access(client, normalized_ref, entity)
 
         rows: list[dict] = []
-        async for msg in client.iter_messages(entity, limit=limit):
+        async for msg in client.iter_messages(entity, limit=limit, min_id=int(min_id or 0)):
             if not isinstance(msg, Message):
                 continue
 
             if msg.id is None:
                 continue
 
-            if min_id is not None and int(msg.id) <= int(min_id):
-                continue
-
             msg_dt = msg.date
             if msg_dt is None:
                 continue
             if msg_dt.tzinfo is None:
                 msg_dt = msg_dt.replace(tzinfo=timezone.utc)
 
-            if msg_dt < since_dt:
+            if since_dt is not None and msg_dt < since_dt:
                 break
 
             text = (msg.message or "").strip()
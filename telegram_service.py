@@ -589,13 +589,13 @@ async def fetch_chat_messages_for_subscription(
     db: AsyncSession,
     owner_user_id: int,
     chat_link: str,
-    since_dt: datetime,
+    since_dt: Optional[datetime],
     min_id: Optional[int] = None,
     limit: int = 3000,
 ) -> Tuple[object, List[Dict]]:
     """
     Возвращает entity и список сообщений (старые -> новые) со стабильными message_id.
-    since_dt: нижняя граница по времени (UTC).
+    since_dt: нижняя граница по времени (UTC); None — без фильтра по времени.
     min_id: если задан — берём только сообщения с id > min_id (cursor).
     """
     client = await ensure_connected(db, owner_user_id)
@@ -643,7 +643,10 @@ async def fetch_chat_messages_for_subscription(
     if not entity:
         raise ValueError("CHAT_ENTITY_NOT_RESOLVED")
 
-    if since_dt.tzinfo is None:
+    # фильтр по времени используем только для первого запуска (когда cursor не задан)
+    if min_id is not None:
+        since_dt = None
+    if since_dt is not None and since_dt.tzinfo is None:
         since_dt = since_dt.replace(tzinfo=timezone.utc)
 
     out = []
@@ -655,8 +658,7 @@ async def fetch_chat_messages_for_subscription(
         if msg_dt.tzinfo is None:
             msg_dt = msg_dt.replace(tzinfo=timezone.utc)
 
-        # фильтр по времени используем только для первого запуска (когда cursor не задан)
-        if (min_id is None) and (msg_dt < since_dt):
+        if since_dt is not None and msg_dt < since_dt:
             break
 
         text = (msg.message or "").strip()
@@ -750,10 +752,19 @@ async def qr_login_recreate(db: AsyncSession, owner_user_id: int):
     return {"url": _qr_login.url, "expires": expires.isoformat() if expires else None}
 
 async def disconnect_tg_client():
-    global tg_client
-    if tg_client is not None:
+    """
+    Отключает все закэшированные Telethon-клиенты: пользовательские
+    (tg_clients) и клиенты сервисных аккаунтов. Вызывается при выходе
+    процесса-воркера.
+    """
+    # локальный импорт: service_account_service сам импортирует этот модуль
+    from service_account_service import disconnect_service_clients
+
+    for owner_user_id in list(tg_clients):
+        client = tg_clients.pop(owner_user_id)
         try:
-            await tg_client.disconnect()
+            await client.disconnect()
         except Exception:
             pass
-        tg_client = None
+
+    await disconnect_service_clients()